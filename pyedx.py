@@ -22,17 +22,23 @@
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 
-import re, gzip, progressbar, time, os, sys, pycountry, unicodedata, math
-from ipaddress import IPv4Address
+import re, gzip, zlib, progressbar, time, os, sys, pycountry, unicodedata, math
+import socket, struct, sqlite3, itertools, shutil, fcntl
 import simplejson as json
 from jsonpath import jsonpath
-import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import threading, Queue
+import cStringIO
+from collections import deque, OrderedDict
+from bisect import bisect_right
 import hashlib
 from dateutil.parser import parse as iso2datetime
 from pytz import timezone
 from calendar import timegm
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import pymongo
+from pymongo import ReplaceOne
 from termcolor import colored, cprint
 import csv
 
@@ -44,81 +50,212 @@ from random import randrange
 import xmltodict
 from xml.etree import ElementTree
 
+# NumPy is optional (only used for batch conversions)
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# Zstandard and LZ4 are optional (only used for .zst and .lz4 files)
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+try:
+	import lz4.frame
+except ImportError:
+	lz4 = None
+
+# Compression codecs of .json files, by file extension (other files are saved with gzip, see SaveIterToJSON)
+Codecs = {'.gz' : 'gzip', '.zst' : 'zstd', '.lz4' : 'lz4'}
+CodecExtensions = {'gzip' : '.gz', 'zstd' : '.zst', 'lz4' : '.lz4'}
+
+# Codec of .json files saved by batch runs (see FindEdxFiles)
+OutputCodec = 'gzip'
+
+# Compression level of .json files (None for default level of codec), and default levels
+OutputCompressionLevel = None
+DefaultCompressionLevels = {'gzip' : 9, 'zstd' : 3, 'lz4' : 0}
+
+# Number of threads compressing .json files (blocks are compressed as separate gzip members/zstd frames/lz4 frames)
+OutputCompressionThreads = 1
+
+# Size of blocks of events written (and compressed) at once
+OutputBlockSize = 1<<22
+
 # Path to IP database
 IPTablePath = 'IPDB.csv'
 
-# Event types dictionary
+# IP database loaded in memory (see LoadIPTable)
+IPTable = None
+
+# Path to binary copy of IP database, memory-mapped by all processes (default: IPTablePath+'.bin', see BuildIPTableFile)
+IPTableBinaryPath = None
+
+# Path to persistent cache of located IPs (SQLite database, safe to share between processes and runs)
+IPCachePath = '.ipcache.sqlite'
+
+# In-process cache of located IPs (IP -> (start IP, end IP, location fields)), in front of the persistent cache
+IPLocationCache = OrderedDict()
+IPLocationCacheSize = 100000
+
+# Connection to persistent IP cache, as (process ID, connection), since connections can't be shared with forked processes
+IPCacheConnection = None
+
+# Number of documents per MongoDB bulk write (see MongoDB_writelist)
+MongoDBBatchSize = 1000
+
+# Write concern of MongoDB bulk writes, as dict of WriteConcern options (e.g. {'w' : 1, 'j' : False}), or None for the collection's default
+MongoDBWriteConcern = None
+
+# Maximum number of batches waiting in queue between parser and MongoDB writer thread (see MongoDB_parseandwrite)
+MongoDBQueueSize = 8
+
+# Number of documents per cursor batch of MongoDB reads (see MongoDB_read)
+MongoDBReadBatchSize = 5000
+
+# Document fields of MongoDB query filters, per item class (see MongoDB_read). StudentIP documents have StudentID as _id (see MongoDB_document)
+MongoDBEventFields = {'CourseID' : 'CourseID', 'StudentID' : 'Event.StudentID', 'EventType' : 'Event.EventType', 'Time' : 'Event.TimeStamp.POSIX'}
+MongoDBFields = {
+	'Click' : MongoDBEventFields,
+	'Forum' : MongoDBEventFields,
+	'SignUp' : MongoDBEventFields,
+	'StudentIP' : {'StudentID' : '_id'},
+	'Video' : {'CourseID' : 'CourseID'},
+	'Problem' : {'CourseID' : 'CourseID'}
+}
+
+# Compound indexes of MongoDB collections, per item class (see MongoDB_createindexes)
+# Queries by course, by student, and by course and event type, all of them over a time range
+MongoDBEventIndexes = [
+	[('CourseID', pymongo.ASCENDING), ('Event.TimeStamp.POSIX', pymongo.ASCENDING)],
+	[('Event.StudentID', pymongo.ASCENDING), ('Event.TimeStamp.POSIX', pymongo.ASCENDING)],
+	[('CourseID', pymongo.ASCENDING), ('Event.EventType', pymongo.ASCENDING), ('Event.TimeStamp.POSIX', pymongo.ASCENDING)]
+]
+MongoDBIndexes = {
+	'Click' : MongoDBEventIndexes,
+	'Forum' : MongoDBEventIndexes,
+	'SignUp' : MongoDBEventIndexes,
+	'StudentIP' : [[('IP', pymongo.ASCENDING)]],
+	'Video' : [[('CourseID', pymongo.ASCENDING)]],
+	'Problem' : [[('CourseID', pymongo.ASCENDING)]]
+}
+
+# Directory of parse cache, where .json files are stored by content of parsed file (see GetParseCacheKey). None to disable
+ParseCacheDir = None
+
+# Version of parser, part of parse cache keys (see GetParserVersion)
+ParserVersion = None
+
+# Number of input lines between checkpoints of resumable parsing (see ParseAndResume)
+CheckpointInterval = 100000
+
+# Size of decompressed blocks read by read-ahead threads, and maximum number of blocks waiting to be parsed per file (see StartReadAhead)
+ReadAheadBlockSize = 1<<20
+ReadAheadQueueSize = 8
+
+# Read-ahead threads started for files that will be read next (file path -> read-ahead, see IterEventFile)
+PrefetchedFiles = {}
+
+# Event types dictionary (category -> EdX event tag -> event type)
+# Tags are matched in the order listed here: when several tags match at the same position of the event_type field, the first one wins
+# Use RegisterEventType() to add new EdX event types
 EventTypes = {
 
-'Account' :
-	{	'edx.course.enrollment.activated' 			: 'Account.Activate',
-		'edx.course.enrollment.deactivated' 		: 'Account.Deactivate',
-		'students_update_enrollment' 				: 'Account.InfoUpdate',
-		'edx.course.enrollment.mode_changed' 		: 'Account.Upgrade',
-		'edx.course.enrollment.upgrade.succeeded' 	: 'Account.Upgrade.Receipt',
-		'accounts/login' 							: 'Account.Login'
-	},
-'Video' :
-	{	'load_video' 				: 'Video.Load',
-		'play_video' 				: 'Video.Play',
-		'pause_video' 				: 'Video.Pause',
-		'seek_video' 				: 'Video.Seek',
-		'stop_video' 				: 'Video.Stop',
-		'speed_change_video' 		: 'Video.SpeedChange',
-		'show_transcript' 			: 'Video.Transcript.Show',
-		'hide_transcript' 			: 'Video.Transcript.Hide',
-		'transcript/download' 		: 'Video.Transcript.Download',
-		'transcript/translation/en' : 'Video.Transcript.Translate.EN',
-		'transcript/translation/fr' : 'Video.Transcript.Translate.FR',
-		'transcript/translation' 	: 'Video.Transcript.Translate'
-	},
-'Problem' : 
-	{	'problem_show' 			: 'Problem.Show',
-		'problem_check' 		: 'Problem.Check',
-		'problem_check_fail' 	: 'Problem.Check.Fail',
-		'problem_graded' 		: 'Problem.Graded',
-		'problem_save' 			: 'Problem.Save',
-		'save_problem_fail' 	: 'Problem.Save.Fail',
-		'save_problem_success' 	: 'Problem.Save.Success',
-		'reset_problem' 		: 'Problem.Reset',
-		'problem_reset' 		: 'Problem.Reset',
-		'reset_problem_fail' 	: 'Problem.Reset.Fail'
-	},
-'Forum' :
-	{	'comments/[^/]*/delete'									: 'Forum.Post.Delete', # Delete "post on thread" and "comment on post"
-		'comments/[^/]*/flagAbuse'								: 'Forum.Post.Report',
-		#'comments/[^/]*/reply'									: 'Forum.Post.CommentOn', # Comment on post
-		'comments/[^/]*/unFlagAbuse'							: 'Forum.Post.Unreport',
-		'comments/[^/]*/unvote'									: 'Forum.Post.Unvote',
-		'comments/[^/]*/update'									: 'Forum.Post.Update',
-		'comments/[^/]*/upvote'									: 'Forum.Post.Upvote',
-		'forum'													: 'Forum.Load',
-		'forum\)'												: 'Forum.Load',
-		'forum/'												: 'Forum.Load',
-		'forum/[^/]*/inline'									: 'Forum.Unknown',
-		'forum/[^/]*/threads/[^/]*'								: 'Forum.Thread.View',
-		#'forum/[^/]*/threads/create'							: 'Forum.Thread.Launch', # Thread launch
-		'forum/i4x-edx-templates-course-Empty/inline'			: 'Forum.Unknown',
-		'forum/i4x-edx-templates-course-Empty/threads/[^/]*'	: 'Forum.Unknown',
-		'forum/i4x-EPFLx-[^-]*-course-[^/]*/threads/[^/]*'		: 'Forum.Thread.View',
-		'forum/search'											: 'Forum.Search',
-		'forum/undefined/threads/[^/]*'							: 'Forum.Thread.View',
-		'forum/users/[^/]*'										: 'Forum.User.View',
-		'i4x-edx-templates-course-Empty/threads/create'			: 'Forum.Thread.Launch',
-		'threads/[^/]*/delete'									: 'Forum.Thread.Delete', # Delete lauched thread
-		'threads/[^/]*/flagAbuse'								: 'Forum.Thread.Unreport',
-		'threads/[^/]*/follow'									: 'Forum.Thread.Follow',
-		'threads/[^/]*/pin'										: 'Forum.Thread.Pin',
-		#'threads/[^/]*/reply'									: 'Forum.Thread.PostOn', # Post on thread
-		'threads/[^/]*/unFlagAbuse'								: 'Forum.Thread.Report',
-		'threads/[^/]*/unfollow'								: 'Forum.Thread.Unfollow',
-		'threads/[^/]*/unvote'									: 'Forum.Thread.Unvote',
-		'threads/[^/]*/update'									: 'Forum.Thread.Update',
-		'threads/[^/]*/upvote'									: 'Forum.Thread.Upvote',
-		'upload'												: 'Forum.Upload'
-	}
+'Account' : OrderedDict([
+	('edx.course.enrollment.activated', 			'Account.Activate'),
+	('edx.course.enrollment.deactivated', 		'Account.Deactivate'),
+	('students_update_enrollment', 				'Account.InfoUpdate'),
+	('edx.course.enrollment.mode_changed', 		'Account.Upgrade'),
+	('edx.course.enrollment.upgrade.succeeded', 	'Account.Upgrade.Receipt'),
+	('accounts/login', 							'Account.Login'),
+	]),
+'Video' : OrderedDict([
+	('load_video', 				'Video.Load'),
+	('play_video', 				'Video.Play'),
+	('pause_video', 				'Video.Pause'),
+	('seek_video', 				'Video.Seek'),
+	('stop_video', 				'Video.Stop'),
+	('speed_change_video', 		'Video.SpeedChange'),
+	('show_transcript', 			'Video.Transcript.Show'),
+	('hide_transcript', 			'Video.Transcript.Hide'),
+	('transcript/download', 		'Video.Transcript.Download'),
+	('transcript/translation/en', 'Video.Transcript.Translate.EN'),
+	('transcript/translation/fr', 'Video.Transcript.Translate.FR'),
+	('transcript/translation', 	'Video.Transcript.Translate'),
+	]),
+'Problem' : OrderedDict([
+	('problem_show', 			'Problem.Show'),
+	('problem_check', 		'Problem.Check'),
+	('problem_check_fail', 	'Problem.Check.Fail'),
+	('problem_graded', 		'Problem.Graded'),
+	('problem_save', 			'Problem.Save'),
+	('save_problem_fail', 	'Problem.Save.Fail'),
+	('save_problem_success', 	'Problem.Save.Success'),
+	('reset_problem', 		'Problem.Reset'),
+	('problem_reset', 		'Problem.Reset'),
+	('reset_problem_fail', 	'Problem.Reset.Fail'),
+	]),
+'Forum' : OrderedDict([
+	('comments/[^/]*/delete', 									'Forum.Post.Delete'), # Delete "post on thread" and "comment on post"
+	('comments/[^/]*/flagAbuse', 								'Forum.Post.Report'),
+	#('comments/[^/]*/reply', 									'Forum.Post.CommentOn'), # Comment on post
+	('comments/[^/]*/unFlagAbuse', 							'Forum.Post.Unreport'),
+	('comments/[^/]*/unvote', 									'Forum.Post.Unvote'),
+	('comments/[^/]*/update', 									'Forum.Post.Update'),
+	('comments/[^/]*/upvote', 									'Forum.Post.Upvote'),
+	('forum', 													'Forum.Load'),
+	('forum\)', 												'Forum.Load'),
+	('forum/', 												'Forum.Load'),
+	('forum/[^/]*/inline', 									'Forum.Unknown'),
+	('forum/[^/]*/threads/[^/]*', 								'Forum.Thread.View'),
+	#('forum/[^/]*/threads/create', 							'Forum.Thread.Launch'), # Thread launch
+	('forum/i4x-edx-templates-course-Empty/inline', 			'Forum.Unknown'),
+	('forum/i4x-edx-templates-course-Empty/threads/[^/]*', 	'Forum.Unknown'),
+	('forum/i4x-EPFLx-[^-]*-course-[^/]*/threads/[^/]*', 		'Forum.Thread.View'),
+	('forum/search', 											'Forum.Search'),
+	('forum/undefined/threads/[^/]*', 							'Forum.Thread.View'),
+	('forum/users/[^/]*', 										'Forum.User.View'),
+	('i4x-edx-templates-course-Empty/threads/create', 			'Forum.Thread.Launch'),
+	('threads/[^/]*/delete', 									'Forum.Thread.Delete'), # Delete lauched thread
+	('threads/[^/]*/flagAbuse', 								'Forum.Thread.Unreport'),
+	('threads/[^/]*/follow', 									'Forum.Thread.Follow'),
+	('threads/[^/]*/pin', 										'Forum.Thread.Pin'),
+	#('threads/[^/]*/reply', 									'Forum.Thread.PostOn'), # Post on thread
+	('threads/[^/]*/unFlagAbuse', 								'Forum.Thread.Report'),
+	('threads/[^/]*/unfollow', 								'Forum.Thread.Unfollow'),
+	('threads/[^/]*/unvote', 									'Forum.Thread.Unvote'),
+	('threads/[^/]*/update', 									'Forum.Thread.Update'),
+	('threads/[^/]*/upvote', 									'Forum.Thread.Upvote'),
+	('upload', 												'Forum.Upload'),
+	])
 }
 
+# Keywords of the event_type field that select the category of a click event (categories are checked in this order)
+EventCategoryKeywords = [
+	('Account', ['enrollment', 'login']),
+	('Video', ['video', 'transcript']),
+	('Problem', ['problem']),
+	('Forum', ['discussion', 'forum'])
+]
+
+# Patterns of forum URLs in the event_type field. IDs are stripped from the matched URL to get the EventTypes['Forum'] tag
+# (URLs of "reply" and "create" events are recognised, but have no event type, since these events are parsed from the forum .mongo dumps)
+ForumEventPatterns = [
+	'comments/[^/]*/delete$', 'comments/[^/]*/flagAbuse$', 'comments/[^/]*/reply$', 'comments/[^/]*/unFlagAbuse$', 'comments/[^/]*/unvote$', 'comments/[^/]*/update$', 'comments/[^/]*/upvote$',
+	'forum$', r'forum\)$', 'forum/$', 'forum/[^/]*/inline$', 'forum/[^/]*/threads/[^/]*$', 'forum/[^/]*/threads/create$', 'forum/i4x-edx-templates-course-Empty/inline$', 'forum/i4x-edx-templates-course-Empty/threads/[^/]*$', r'forum/i4x-EPFLx-[^\-]*-course-[^/]*/threads/[^/]*$', 'forum/search$', 'forum/undefined/threads/[^/]*$', 'forum/users/[^/]*$',
+	'i4x-edx-templates-course-Empty/threads/create$',
+	'threads/[^/]*/delete$', 'threads/[^/]*/flagAbuse$', 'threads/[^/]*/follow$', 'threads/[^/]*/pin$', 'threads/[^/]*/reply$', 'threads/[^/]*/unFlagAbuse$', 'threads/[^/]*/unfollow$', 'threads/[^/]*/unvote$', 'threads/[^/]*/update$', 'threads/[^/]*/upvote$',
+	'upload'
+]
+
+# Compiled event type classifier (built from EventTypes on first use, see BuildEventTypeClassifier)
+EventTypeClassifier = None
+
+# Cache of classified forum event_type fields (raw event_type -> classification), see ClassifyEventTypePattern
+EventTypeCache = OrderedDict()
+EventTypeCacheSize = 20000
+
 #=========================================================#
 #               GENERAL PURPOSE FUNCTIONS                 #
 #=========================================================#
@@ -128,18 +265,124 @@ def ISO8601_utcnow():
 	return datetime.utcnow().isoformat()+'+00:00'
 
 # Time conversion: ISO8601 to POSIX
+# EdX timestamps (e.g. "2014-10-01T12:34:56.123456+00:00", or "2014-10-01 12:34:56 UTC" in .sql files) are parsed directly, other formats with dateutil
+ISO8601Pattern = re.compile(r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?(?:(Z| UTC)|([+-])(\d{2}):?(\d{2}))$')
+EpochOrdinal = date(1970, 1, 1).toordinal()
 def ISO8601_to_POSIXtime(ISOTime):
+	Match = ISO8601Pattern.match(ISOTime)
+	if Match:
+		Year, Month, Day, Hour, Minute, Second, Fraction, UTC, OffsetSign, OffsetHour, OffsetMinute = Match.groups()
+		try:
+			POSIXTimeInt = (date(int(Year), int(Month), int(Day)).toordinal()-EpochOrdinal)*86400 + int(Hour)*3600 + int(Minute)*60 + int(Second)
+		except ValueError:
+			POSIXTimeInt = None
+		if POSIXTimeInt is not None and int(Hour)<24 and int(Minute)<60 and int(Second)<60:
+			if OffsetSign:
+				Offset = int(OffsetHour)*3600 + int(OffsetMinute)*60
+				POSIXTimeInt -= Offset if OffsetSign=='+' else -Offset
+			usec = int(Fraction.ljust(6, '0')) if Fraction else 0
+			return (POSIXTimeInt*1000000 + usec)/1e6
+	
+	# Other formats
 	DTObj = iso2datetime(ISOTime).astimezone(timezone('UTC'))
 	usec = DTObj.microsecond
 	POSIXTimeInt = timegm(DTObj.timetuple())
-	POSIXTime = float(str(POSIXTimeInt)+'.'+str(usec))
-	return POSIXTime
+	return (POSIXTimeInt*1000000 + usec)/1e6
+
+# Time conversion: ISO8601 to POSIX, for a whole list of timestamps at once
+# Return NumPy float64 array (same values as ISO8601_to_POSIXtime), or list if NumPy is not available
+def ISO8601_to_POSIXtime_Batch(ISOTimes):
+	if numpy is None:
+		return [ISO8601_to_POSIXtime(ISOTime) for ISOTime in ISOTimes]
+	
+	ISOTimes = numpy.asarray(ISOTimes)
+	POSIXTimes = numpy.empty(len(ISOTimes), dtype='float64')
+	if len(ISOTimes)==0:
+		return POSIXTimes
+	
+	# UTC timestamps are converted by NumPy's datetime64 parser once the time zone is stripped out
+	IsUTC = numpy.char.endswith(ISOTimes, '+00:00') | numpy.char.endswith(ISOTimes, 'Z') | numpy.char.endswith(ISOTimes, ' UTC')
+	try:
+		NaiveTimes = numpy.char.replace(numpy.char.replace(numpy.char.rstrip(ISOTimes[IsUTC], 'Z'), '+00:00', ''), ' UTC', '')
+		IsNaive = (numpy.char.count(NaiveTimes, '-')==2) & (numpy.char.count(NaiveTimes, '+')==0) & (numpy.char.count(NaiveTimes, ':')==2)
+		IsUTC[IsUTC] = IsNaive
+		POSIXTimes[IsUTC] = NaiveTimes[IsNaive].astype('datetime64[us]').astype('int64')/1e6
+	except ValueError:
+		IsUTC[:] = False
+	
+	# Other timestamps one by one
+	for i in numpy.flatnonzero(~IsUTC):
+		POSIXTimes[i] = ISO8601_to_POSIXtime(ISOTimes[i])
+	
+	return POSIXTimes
 
 # Time conversion: POSIX to ISO8601	
 def POSIXtime_to_ISO8601(POSIXTime):
 	ISOTime = datetime.utcfromtimestamp(POSIXTime).isoformat()+'+00:00'
 	return ISOTime
 	
+# JSON backends, in order of preference (see SetJSONBackend)
+# Only decoding goes through the selected backend: JSON is always encoded with simplejson, so that .json.gz files keep the same format
+JSONBackends = ['orjson', 'ujson', 'simplejson']
+JSONBackend = 'simplejson'
+DecodeJSON = json.loads
+EncodeJSON = json.dumps
+
+# Select JSON backend (default: first installed backend of JSONBackends). Return name of active backend
+def SetJSONBackend(Backend=None):
+	global JSONBackend, DecodeJSON
+	
+	for Name in ([Backend] if Backend else JSONBackends):
+		if Name=='simplejson':
+			Decoder = json.loads
+		else:
+			try:
+				Module = __import__(Name)
+			except ImportError:
+				continue
+			Decoder = Module.loads
+			# Older ujson versions round floats (e.g. POSIX times) unless asked not to
+			if Name=='ujson':
+				try:
+					Module.loads('0.1', precise_float=True)
+					Decoder = lambda JSONString: Module.loads(JSONString, precise_float=True)
+				except TypeError:
+					pass
+		JSONBackend = Name
+		DecodeJSON = Decoder
+		return JSONBackend
+	
+	cprint('[Error] SetJSONBackend() - JSON backend not installed: %s' % Backend, 'red')
+	exit()
+
+# Get name of active JSON backend
+def GetJSONBackend():
+	return JSONBackend
+
+SetJSONBackend()
+
+# Decode event, unless it was decoded already (e.g. row of .sql table, see ImportCSVTable)
+def DecodeEvent(JSONString):
+	if isinstance(JSONString, dict):
+		return JSONString
+	return DecodeJSON(JSONString)
+
+# Get value from LRU cache (OrderedDict), and mark it as most recently used. Return Default if key is not cached
+def LRUCacheGet(Cache, Key, Default=None):
+	try:
+		Value = Cache.pop(Key)
+	except KeyError:
+		return Default
+	Cache[Key] = Value
+	return Value
+
+# Store value in LRU cache (OrderedDict), dropping the least recently used values beyond MaxSize
+def LRUCacheSet(Cache, Key, Value, MaxSize):
+	Cache.pop(Key, None)
+	Cache[Key] = Value
+	while len(Cache)>MaxSize:
+		Cache.popitem(last=False)
+
 # Pretty-print JSON
 def printjson(s, Color='grey'):
 	cprint(json.dumps(s, sort_keys=True, indent=4, separators=(',', ': ')), Color)
@@ -158,20 +401,128 @@ def GenerateEventID(CourseID, StudentID, ISOTime, EventType):
 	
 # Save event list as JSON file
 def SaveListToJSON(ItemList, JSONFilePath):
+	SaveIterToJSON(ItemList, JSONFilePath)
+	return True
+
+# Save events as JSON file while they are being produced (ItemIter may be a generator). Return number of events saved
+# Events are written in blocks of OutputBlockSize bytes, compressed with the codec of the file extension (.gz, .zst, .lz4, or gzip otherwise)
+# With OutputCompressionThreads>1, blocks are compressed in parallel as separate members/frames (read as a single stream by gzip/zstd/lz4 readers)
+def SaveIterToJSON(ItemIter, JSONFilePath):
+
+	Codec = GetFileCodec(JSONFilePath) or 'gzip'
+	Level = OutputCompressionLevel if OutputCompressionLevel is not None else DefaultCompressionLevels[Codec]
+	if (Codec=='zstd' and zstandard is None) or (Codec=='lz4' and lz4 is None):
+		cprint('[Clean JSON] [Error] Codec not installed: %s' % Codec, 'red')
+		exit()
+
+	# Write into temporary file first, so that an interrupted run never leaves a truncated .json file behind
+	TempFilePath = '%s.%s.tmp' % (JSONFilePath, os.getpid())
 	try:
-		f = gzip.open(JSONFilePath, 'w')
-		for Item in ItemList:
-			JSONString = json.dumps(Item)
-			f.write("%s\n" % JSONString)
-		f.close()
-		cprint('[Clean JSON] [Success] File saved: %s' % JSONFilePath, 'green')
-		return True
-	except:
-		cprint('[Clean JSON] [Success] File saved: %s' % JSONFilePath, 'red')
+		RawFile = open(TempFilePath, 'wb')
+		# Single-threaded gzip output is one member, whose header is written with the name of the final file (same output as gzip.open(JSONFilePath))
+		if Codec=='gzip' and OutputCompressionThreads<=1:
+			f = gzip.GzipFile(JSONFilePath, 'wb', Level, RawFile)
+		else:
+			f = None
+	except (IOError, OSError):
+		cprint('[Clean JSON] [Error] Could not create file: %s' % JSONFilePath, 'red')
+		exit()
+
+	Counter = {'NumItems' : 0}
+	Pool = ThreadPool(OutputCompressionThreads) if OutputCompressionThreads>1 else None
+	try:
+		Blocks = IterJSONBlocks(ItemIter, Counter)
+		if f:
+			for Block in Blocks:
+				f.write(Block)
+			f.close()
+		elif Pool:
+			# Keep a bounded number of blocks in flight, and write them in order
+			Pending = deque()
+			for Block in Blocks:
+				Pending.append(Pool.apply_async(CompressBlock, (Block, Codec, Level)))
+				if len(Pending)>=2*OutputCompressionThreads:
+					RawFile.write(Pending.popleft().get())
+			while Pending:
+				RawFile.write(Pending.popleft().get())
+		else:
+			for Block in Blocks:
+				RawFile.write(CompressBlock(Block, Codec, Level))
+		RawFile.close()
+		os.rename(TempFilePath, JSONFilePath)
+	except (IOError, OSError):
+		RawFile.close()
+		os.remove(TempFilePath)
+		cprint('[Clean JSON] [Error] Could not save file: %s' % JSONFilePath, 'red')
 		exit()
+	except:
+		RawFile.close()
+		os.remove(TempFilePath)
+		raise
+	finally:
+		if Pool:
+			Pool.terminate()
+
+	cprint('[Clean JSON] [Success] File saved: %s' % JSONFilePath, 'green')
+	return Counter['NumItems']
+
+# Join events into blocks of about OutputBlockSize bytes (one event per line), counting events
+def IterJSONBlocks(ItemIter, Counter):
+	Lines = []
+	BlockSize = 0
+	for Item in ItemIter:
+		# Items may already be encoded as JSON strings (see IterParseEventList)
+		if isinstance(Item, basestring):
+			JSONString = Item
+		else:
+			JSONString = EncodeJSON(Item)
+		Lines.append(JSONString)
+		Lines.append('\n')
+		BlockSize += len(JSONString)+1
+		Counter['NumItems'] += 1
+		if BlockSize>=OutputBlockSize:
+			yield ''.join(Lines)
+			Lines = []
+			BlockSize = 0
+	# An empty file still gets one (empty) block, so that it is a valid gzip/zstd/lz4 stream
+	if Lines or Counter['NumItems']==0:
+		yield ''.join(Lines)
+
+# Compress block as a complete gzip member, zstd frame, or lz4 frame (compression runs without the GIL, so blocks can be compressed in threads)
+def CompressBlock(Block, Codec, Level):
+	if isinstance(Block, unicode):
+		Block = Block.encode('utf-8')
+	if Codec=='gzip':
+		Compressor = zlib.compressobj(Level, zlib.DEFLATED, -zlib.MAX_WBITS)
+		Header = '\037\213\010\000' + struct.pack('<I', int(time.time())) + ('\002' if Level==9 else '\004' if Level==1 else '\000') + '\377'
+		return Header + Compressor.compress(Block) + Compressor.flush() + struct.pack('<II', zlib.crc32(Block) & 0xffffffff, len(Block) & 0xffffffff)
+	elif Codec=='zstd':
+		return zstandard.ZstdCompressor(level=Level).compress(Block)
+	elif Codec=='lz4':
+		return lz4.frame.compress(Block, compression_level=Level)
+
+# Get compression codec of file out of its extension. Return None if file is not compressed
+def GetFileCodec(FilePath):
+	return Codecs.get(os.path.splitext(FilePath)[1])
+
+# Open compressed file for reading. Return (decompressed file, raw file)
+def OpenCompressedFile(FilePath):
+	Codec = GetFileCodec(FilePath)
+	if Codec=='gzip':
+		f = gzip.open(FilePath, 'rb')
+		return f, f.fileobj
+	RawFile = open(FilePath, 'rb')
+	if Codec=='zstd':
+		return zstandard.ZstdDecompressor().stream_reader(RawFile, read_across_frames=True), RawFile
+	elif Codec=='lz4':
+		return lz4.frame.LZ4FrameFile(RawFile, 'rb'), RawFile
 
 # Impor CSV-type file into JSON list
 def ImportCSVFile(FilePath):
+	return [EncodeJSON(Row) for Row in ImportCSVTable(FilePath)]
+
+# Import CSV-type file into list of dicts (one per row)
+def ImportCSVTable(FilePath):
 	
 	f = open(FilePath, 'r')
 	Body = f.read().replace('\t','|')
@@ -194,41 +545,35 @@ def ImportCSVFile(FilePath):
 	Keys = CSVList[0]
 	Rows = CSVList[1:]
 	
-	JSONList = []
-	for row in Rows:
-		JSONList.append( json.dumps(dict(zip(Keys,row))) )
-	
-	return JSONList
+	return [dict(zip(Keys,row)) for row in Rows]
 	
-# END DEF ImportCSVFile ----------
+# END DEF ImportCSVTable ----------
 
 #=========================================================#
 #           GENERAL JSON HANDLING FUNCTIONS               #
 #=========================================================#
 
+# Check if attribute(s) exist (AttributePath is a list of paths, e.g. ['context.course_id', 'time'])
 def IsAttribute(JSON, AttributePath):	
 	
-	if len(AttributePath)==1:
-		if jsonpath(JSON, AttributePath):
-			return True
-		else:
+	if isinstance(AttributePath, basestring):
+		AttributePath = [AttributePath]
+	for Path in AttributePath:
+		if not GetAttributeAccessor(Path)(JSON):
 			return False
-	else:
-		for Path in AttributePath:
-			if not jsonpath(JSON, Path):
-				return False
-		return True
+	return True
 
+# Get attribute value. With IgnoreErrors=True, missing or ambiguous attributes are returned as "null" and counted (see PrintAttributeWarnings)
 def GetAttribute(JSON, AttributePath, IgnoreErrors=False):
 	
-	Attribute = jsonpath(JSON, AttributePath)
+	Attribute = GetAttributeAccessor(AttributePath)(JSON)
 	
 	if Attribute:
 		if len(Attribute)==1:
 			return Attribute[0]
 		else:
 			if IgnoreErrors:
-				cprint('[WARNING] GetAttribute() - Error reading attribute: "%s". Returned "null".' % AttributePath, 'magenta')
+				CountAttributeWarning('Error reading attribute', AttributePath)
 				return None
 			else:
 				printjson(JSON, 'red')
@@ -236,12 +581,55 @@ def GetAttribute(JSON, AttributePath, IgnoreErrors=False):
 				exit()
 	else:
 		if IgnoreErrors:
-			cprint('[WARNING] GetAttribute() - Attribute not found: "%s". Returned "null".' % AttributePath, 'magenta')
+			CountAttributeWarning('Attribute not found', AttributePath)
 			return None
 		else:
 			printjson(JSON, 'red')
 			cprint('[ERROR] GetAttribute() - Attribute not found: "%s".' % AttributePath, 'red')
 			exit()
+
+# Compiled attribute paths (path -> function returning the list of matching values, as jsonpath() but [] if none)
+AttributeAccessors = {}
+SimpleAttributePathPattern = re.compile(r'^[A-Za-z0-9_\-]+(\.[A-Za-z0-9_\-]+)*$')
+
+# Get compiled accessor of attribute path. Dotted paths (e.g. "context.course_id") are walked directly, other paths go through jsonpath
+def GetAttributeAccessor(AttributePath):
+	
+	Accessor = AttributeAccessors.get(AttributePath)
+	if Accessor:
+		return Accessor
+	
+	if SimpleAttributePathPattern.match(AttributePath):
+		Keys = tuple((Key, int(Key) if Key.isdigit() else None) for Key in AttributePath.split('.'))
+		def Accessor(JSON):
+			for Key, Index in Keys:
+				if isinstance(JSON, dict) and Key in JSON:
+					JSON = JSON[Key]
+				elif isinstance(JSON, list) and Index is not None and Index<len(JSON):
+					JSON = JSON[Index]
+				else:
+					return []
+			return [JSON]
+	else:
+		def Accessor(JSON):
+			return jsonpath(JSON, AttributePath) or []
+	
+	AttributeAccessors[AttributePath] = Accessor
+	return Accessor
+
+# END DEF GetAttributeAccessor ----------
+
+# Number of attributes returned as "null" by GetAttribute(IgnoreErrors=True) since last report ((warning, path) -> count)
+AttributeWarnings = {}
+
+def CountAttributeWarning(Warning, AttributePath, Count=1):
+	AttributeWarnings[(Warning, AttributePath)] = AttributeWarnings.get((Warning, AttributePath), 0) + Count
+
+# Print one line per counted attribute warning, and reset counters
+def PrintAttributeWarnings():
+	for (Warning, AttributePath), Count in sorted(AttributeWarnings.items()):
+		cprint('[WARNING] GetAttribute() - %s: "%s" (%s event(s)). Returned "null".' % (Warning, AttributePath, Count), 'magenta')
+	AttributeWarnings.clear()
 		
 #=========================================================#
 #         ERROR, WARNING, AND SUCCESS MESSAGES            #
@@ -260,71 +648,580 @@ def Warning_MissingAttribute(ItemClass, AttributeName):
 
 # Parse Edx .log file, and save into CEDE .json file if it doesn't exist yet
 # This is the main function in this library, and ideally the only one that needs to be called
-def ParseAndSave(LOGFilePath, JSONFilePath, ItemClass, Locate=False, KeepAlive=False):
+# With parse cache, existing .json files are only kept if they are up to date (see IsParseKeyCurrent)
+def ParseAndSave(LOGFilePath, JSONFilePath, ItemClass, Locate=False, KeepAlive=False, Workers=1, PreviousItems=None):
 	
 	# Check if .json file exists
-	if not os.path.isfile(JSONFilePath):
+	if not os.path.isfile(JSONFilePath) or (ParseCacheDir and not PreviousItems and not IsParseKeyCurrent(LOGFilePath, JSONFilePath, ItemClass, Locate, KeepAlive)):
 		# If not, parse file and save
-		Output = ParseAndReplace(LOGFilePath, JSONFilePath, ItemClass, Locate, KeepAlive)
+		Output = ParseAndReplace(LOGFilePath, JSONFilePath, ItemClass, Locate, KeepAlive, Workers, PreviousItems)
 		return Output
+	elif ParseCacheDir and not PreviousItems:
+		cprint('[EdX Log] [%s Data] [Cached] File is up to date: %s' % (ItemClass, JSONFilePath), 'green')
+		return False
 	else:
 		# If yes, return and print "File exists" message
 		cprint('[EdX Log] [%s Data] [Warning] File already exists. To overwrite, use pyedx.ParseAndReplace()\n%s' % (ItemClass, JSONFilePath), 'yellow')
 		return False
 
 # Parse Edx .log file, and save into CEDE .json file
-def ParseAndReplace(LOGFilePath, JSONFilePath, ItemClass, Locate=False, KeepAlive=False):
+# With parse cache, the .json file is taken from the cache if the same content was parsed before (and stored into the cache otherwise)
+def ParseAndReplace(LOGFilePath, JSONFilePath, ItemClass, Locate=False, KeepAlive=False, Workers=1, PreviousItems=None):
+
+	# Look up parse cache (items parsed against a previous forum snapshot are not cached)
+	CacheKey = None
+	RemoveParseKey(JSONFilePath)
+	if ParseCacheDir and not PreviousItems:
+		ContentHash = GetContentHash(LOGFilePath)
+		CacheKey = GetParseCacheKey(LOGFilePath, ItemClass, Locate, KeepAlive, ContentHash)
+		if LoadFromParseCache(LOGFilePath, JSONFilePath, ItemClass, CacheKey, ContentHash):
+			cprint('[EdX Log] [%s Data] [Cached] File was parsed before: %s' % (ItemClass, LOGFilePath), 'green')
+			return True
+
+	# Parse file (events are streamed from input to output, see ParseFile)
+	ItemList = ParseFile(LOGFilePath, ItemClass, Locate, KeepAlive, Workers, Encode=True, PreviousItems=PreviousItems)
+
+	# Save to JSON file if list is not empty
+	NumItems = SaveIterToJSON(ItemList, JSONFilePath)
+	if CacheKey:
+		SaveToParseCache(LOGFilePath, JSONFilePath, CacheKey, ContentHash)
+	if NumItems>0:
+		return True
+	# Return with warning if list is empty
+	else:
+		cprint('[EdX Log] [%s Data] [Warning] Parsing function returned empty JSON item list. An empty file was saved.' % ItemClass, 'magenta')
+		return True
+		
+# END DEF ParseAndReplace ----------
+
+# Get parse cache key of Edx file: hash of file content, parser version, item class, and options the output depends on
+# Video and problem fields read from the file path are not part of the key (they are stamped again on cached items, see LoadFromParseCache)
+def GetParseCacheKey(LOGFilePath, ItemClass, Locate=False, KeepAlive=False, ContentHash=None):
+	
+	KeyFields = [ContentHash or GetContentHash(LOGFilePath), GetParserVersion(), JSONBackend, ItemClass]
+	if ItemClass=='StudentIP' and Locate:
+		KeyFields += ['Locate', GetIPTableVersion()]
+	if ItemClass=='Video' and KeepAlive:
+		KeyFields += ['KeepAlive']
+	return GenerateFileID('|'.join(str(KeyField) for KeyField in KeyFields))
+
+# Get MD5 hash of file content
+def GetContentHash(FilePath):
+	ContentHash = hashlib.md5()
+	f = open(FilePath, 'rb')
+	for Block in iter(lambda: f.read(1<<20), ''):
+		ContentHash.update(Block)
+	f.close()
+	return ContentHash.hexdigest()
+
+# Get version of parser: hash of the source of this module, so that cached files are parsed again whenever the parser changes
+def GetParserVersion():
+	global ParserVersion
+	if ParserVersion is None:
+		SourcePath = re.sub(r'\.py[co]$', '.py', os.path.abspath(__file__))
+		ParserVersion = GenerateFileID(ReadTextFile(SourcePath))
+	return ParserVersion
+
+# Get path of .json file in parse cache
+def GetParseCachePath(CacheKey):
+	return os.path.join(ParseCacheDir, CacheKey[:2], CacheKey+'.json.gz')
+
+# Save .json file of Edx file from parse cache, and record its key. Return False if file is not in cache
+# Cached files are hard-linked (or copied), and get their own copy before they are appended to (see DetachFromParseCache). Video and problem items get the fields of their own file path
+def LoadFromParseCache(LOGFilePath, JSONFilePath, ItemClass, CacheKey, ContentHash):
+	
+	CachePath = GetParseCachePath(CacheKey)
+	if not os.path.isfile(CachePath):
+		return False
+	
+	if ItemClass in ['Video', 'Problem']:
+		PathFields = ReadXMLPathFields(LOGFilePath, ItemClass)
+		if not PathFields:
+			return False
+		LastLoggedDate, CourseID, ItemID = PathFields
+		ItemList = []
+		for JSONString in IterEventFile(CachePath):
+			# Key order is kept, so that items are encoded as if they had been parsed
+			Item = json.loads(JSONString, object_pairs_hook=OrderedDict)
+			Item.update({'CourseID' : CourseID, '%sID' % ItemClass : ItemID, 'LastLoggedDate' : LastLoggedDate})
+			for ProblemPart in Item.get('ProblemParts', []):
+				ProblemPart['ParentProblemID'] = ItemID
+			ItemList.append(Item)
+		SaveIterToJSON(ItemList, JSONFilePath)
+	else:
+		LinkFile(CachePath, JSONFilePath)
+	SaveParseKey(LOGFilePath, JSONFilePath, CacheKey, ContentHash)
+	
+	return True
+
+# Store .json file into parse cache, and record its key
+def SaveToParseCache(LOGFilePath, JSONFilePath, CacheKey, ContentHash):
+	CachePath = GetParseCachePath(CacheKey)
+	CacheDir = os.path.dirname(CachePath)
+	if not os.path.isdir(CacheDir):
+		try:
+			os.makedirs(CacheDir)
+		except OSError:
+			# Directory may have been created by another process
+			if not os.path.isdir(CacheDir):
+				raise
+	LinkFile(JSONFilePath, CachePath)
+	SaveParseKey(LOGFilePath, JSONFilePath, CacheKey, ContentHash)
+
+# Record key of .json file (JSONFilePath+'.key'), with the Edx file it was parsed from, and the sizes and modification time that show the files are unchanged
+def SaveParseKey(LOGFilePath, JSONFilePath, CacheKey, ContentHash):
+	LOGFileStat = os.stat(LOGFilePath)
+	ParseKey = {'CacheKey' : CacheKey, 'ContentHash' : ContentHash, 'LOGFilePath' : os.path.abspath(LOGFilePath), 'LOGFileSize' : LOGFileStat.st_size, 'LOGFileMTime' : LOGFileStat.st_mtime, 'JSONFileSize' : os.path.getsize(JSONFilePath)}
+	SaveManifest(ParseKey, JSONFilePath+'.key')
+
+# Check if .json file was saved from the current content of Edx file, with the current parser and options
+# Edx file is only read (and hashed again) if its size or modification time changed since the key was recorded
+def IsParseKeyCurrent(LOGFilePath, JSONFilePath, ItemClass, Locate=False, KeepAlive=False):
 	
-	# Parse and save "mouse click", "forum activity", and "course sign up" event types
+	try:
+		ParseKey = LoadCheckpoint(JSONFilePath+'.key')
+	except ValueError:
+		return False
+	if not ParseKey or ParseKey['LOGFilePath']!=os.path.abspath(LOGFilePath) or not os.path.isfile(JSONFilePath) or os.path.getsize(JSONFilePath)!=ParseKey['JSONFileSize']:
+		return False
+	
+	LOGFileStat = os.stat(LOGFilePath)
+	if LOGFileStat.st_size==ParseKey['LOGFileSize'] and LOGFileStat.st_mtime==ParseKey['LOGFileMTime']:
+		ContentHash = ParseKey['ContentHash']
+	else:
+		ContentHash = GetContentHash(LOGFilePath)
+	if GetParseCacheKey(LOGFilePath, ItemClass, Locate, KeepAlive, ContentHash)!=ParseKey['CacheKey']:
+		return False
+	
+	# Edx file was touched but not changed: record its new modification time
+	if ContentHash!=ParseKey['ContentHash'] or LOGFileStat.st_mtime!=ParseKey['LOGFileMTime']:
+		SaveParseKey(LOGFilePath, JSONFilePath, ParseKey['CacheKey'], ContentHash)
+	return True
+
+# Remove recorded key of .json file (e.g. when it's saved without parse cache)
+def RemoveParseKey(JSONFilePath):
+	if os.path.isfile(JSONFilePath+'.key'):
+		os.remove(JSONFilePath+'.key')
+
+# Give .json file its own copy before it's written in place (if it's hard-linked, e.g. to parse cache), and remove its recorded key
+def DetachFromParseCache(JSONFilePath):
+	RemoveParseKey(JSONFilePath)
+	if os.path.isfile(JSONFilePath) and os.stat(JSONFilePath).st_nlink>1:
+		CopyFile(JSONFilePath, JSONFilePath)
+
+# Hard-link file to new path (or copy it, e.g. across file systems). Existing file is replaced atomically
+def LinkFile(FilePath, NewFilePath):
+	TempFilePath = '%s.%s.tmp' % (NewFilePath, os.getpid())
+	try:
+		os.link(FilePath, TempFilePath)
+	except OSError:
+		CopyFile(FilePath, NewFilePath)
+		return
+	os.rename(TempFilePath, NewFilePath)
+
+# Copy file to new path. Existing file is replaced atomically
+def CopyFile(FilePath, NewFilePath):
+	TempFilePath = '%s.%s.tmp' % (NewFilePath, os.getpid())
+	try:
+		shutil.copyfile(FilePath, TempFilePath)
+	except:
+		if os.path.isfile(TempFilePath):
+			os.remove(TempFilePath)
+		raise
+	os.rename(TempFilePath, NewFilePath)
+
+# Parse Edx .log file (or .mongo file) into CEDE .json file, recording checkpoints every CheckpointInterval lines (default path: JSONFilePath+'.checkpoint')
+# An interrupted run is resumed from its last checkpoint, and if the .log file has grown since the last run, only the new lines are parsed
+# Events of each checkpoint are saved as a separate gzip member of the .json file (multi-member gzip files are read as a single stream)
+def ParseAndResume(LOGFilePath, JSONFilePath, ItemClass, Workers=1, CheckpointPath=None):
+	
+	if not ItemClass in ['Click', 'Forum'] or LOGFilePath.endswith('.sql') or LOGFilePath.endswith('.csv'):
+		cprint('[EdX Log] [%s Data] [Error] ParseAndResume() - Only .log and .mongo files can be parsed with checkpoints: %s' % (ItemClass, LOGFilePath), 'red')
+		exit()
+	
+	CheckpointPath = CheckpointPath or JSONFilePath+'.checkpoint'
+	cprint('[EdX Log] [%s Data] [Parsing...] EdX Log --> Clean JSON\n%s' % (ItemClass, LOGFilePath), 'green', 'on_blue')
+	StartTime = time.time()
+	
+	f = OpenEventFile(LOGFilePath)
+	RawFile = f.fileobj if isinstance(f, gzip.GzipFile) else f
+	Head = hashlib.md5(f.readline()).hexdigest()
+	
+	# Resume from last checkpoint, unless .log file was replaced or .json file was truncated since then
+	Checkpoint = LoadCheckpoint(CheckpointPath)
+	if Checkpoint and (Checkpoint['ItemClass']!=ItemClass or Checkpoint['Head']!=Head or not os.path.isfile(JSONFilePath) or os.path.getsize(JSONFilePath)<Checkpoint['OutputSize']):
+		Checkpoint = None
+	if Checkpoint:
+		f.seek(Checkpoint['Offset'])
+		if f.tell()!=Checkpoint['Offset']:
+			Checkpoint = None
+	if Checkpoint:
+		print('[EdX Log] [%s Data] Resuming from checkpoint: line %s, %s event(s) saved.' % (ItemClass, Checkpoint['LineNumber'], Checkpoint['EventCount']))
+	else:
+		Checkpoint = {'LOGFilePath' : LOGFilePath, 'JSONFilePath' : JSONFilePath, 'ItemClass' : ItemClass, 'Head' : Head, 'Offset' : 0, 'CompressedOffset' : 0, 'LineNumber' : 0, 'EventCount' : 0, 'OutputSize' : 0}
+		f.seek(0)
+	
+	# Drop events saved after last checkpoint
+	OutputDir = os.path.dirname(JSONFilePath)
+	if OutputDir and not os.path.isdir(OutputDir):
+		os.makedirs(OutputDir)
+	DetachFromParseCache(JSONFilePath)
+	Output = open(JSONFilePath, 'r+b' if os.path.isfile(JSONFilePath) else 'wb')
+	Output.truncate(Checkpoint['OutputSize'])
+	Output.seek(Checkpoint['OutputSize'])
+	
+	# Lines are read one at a time (not with the file iterator), so that offsets are exact. A last line still being written (no line break) is left for the next run
+	Position = {'Offset' : Checkpoint['Offset'], 'NumLines' : 0}
+	def IterCompleteLines():
+		for JSONString in iter(f.readline, ''):
+			if not JSONString.endswith('\n'):
+				return
+			Position['Offset'] += len(JSONString)
+			Position['NumLines'] += 1
+			yield JSONString
+	
+	try:
+		while True:
+			
+			# Parse next lines into new gzip member
+			Position['NumLines'] = 0
+			JSONIter = itertools.islice(IterCompleteLines(), CheckpointInterval)
+			FirstLine = next(JSONIter, None)
+			if FirstLine is None:
+				break
+			Member = gzip.GzipFile(JSONFilePath, 'wb', 9, Output)
+			NumEvents = 0
+			for Event in IterParseEventList(itertools.chain([FirstLine], JSONIter), ItemClass, Workers, Encode=True):
+				Member.write('%s\n' % Event)
+				NumEvents += 1
+			Member.close()
+			Output.flush()
+			os.fsync(Output.fileno())
+			
+			# Record checkpoint
+			Checkpoint.update({'Offset' : Position['Offset'], 'CompressedOffset' : RawFile.tell(), 'LineNumber' : Checkpoint['LineNumber']+Position['NumLines'], 'EventCount' : Checkpoint['EventCount']+NumEvents, 'OutputSize' : Output.tell(), 'UpdatedAt' : ISO8601_utcnow()})
+			SaveManifest(Checkpoint, CheckpointPath)
+			print('[EdX Log] [%s Data] [Checkpoint] Line %s, %s event(s) saved.' % (ItemClass, Checkpoint['LineNumber'], Checkpoint['EventCount']))
+	finally:
+		Output.close()
+		f.close()
+	
+	print('[EdX Log] [%s Data] [Done parsing file] %s event(s) saved. Elapsed time: %s seconds.' % (ItemClass, Checkpoint['EventCount'], int(round(time.time() - StartTime))))
+	PrintAttributeWarnings()
+	
+	return True
+
+# END DEF ParseAndResume ----------
+
+# Load checkpoint of resumable parsing. Return None if there is no checkpoint
+def LoadCheckpoint(CheckpointPath):
+	if not os.path.isfile(CheckpointPath):
+		return None
+	f = open(CheckpointPath, 'r')
+	Checkpoint = json.loads(f.read())
+	f.close()
+	return Checkpoint
+
+# Follow growing Edx .log file (or newest file of a directory of rotating logs), and parse its new lines in micro-batches
+# Events are saved into Sink: .json.gz file (one gzip member appended per batch) or MongoDB collection
+# A batch is saved when it has BatchSize lines, or FlushInterval seconds after its first line was read (maximum latency)
+# Rotated or truncated files are detected between reads. Runs until interrupted, or for Duration seconds. Return number of events saved
+def FollowEventFile(Path, Sink, ItemClass='Click', FlushInterval=5, BatchSize=10000, PollInterval=1, FromStart=False, Duration=None):
+	
+	cprint('[EdX Log] [%s Data] [Following...] EdX Log --> Clean JSON\n%s' % (ItemClass, Path), 'green', 'on_blue')
+	StartTime = time.time()
+	Followed = OpenFollowedFile(Path, FromStart)
+	
+	Batch = []
+	Stats = {'BatchStart' : None, 'NumLines' : 0, 'NumEvents' : 0}
+	Partial = ''
+	try:
+		while Duration is None or time.time()-StartTime<Duration:
+			
+			# Read new complete lines (a line still being written is kept until it's complete)
+			NumRead = 0
+			if Followed:
+				for JSONString in iter(Followed['File'].readline, ''):
+					Partial += JSONString
+					if not Partial.endswith('\n'):
+						break
+					AddFollowedLine(Batch, Partial, Stats)
+					Partial = ''
+					NumRead += 1
+					if len(Batch)>=BatchSize:
+						FlushFollowedEvents(Batch, Sink, ItemClass, Stats)
+			
+			# Switch to new file if file was rotated (the rest of the old file is read first), or read file again from start if it was truncated
+			NewPath = GetFollowedFilePath(Path)
+			if NewPath and (Followed is None or NewPath!=Followed['Path'] or GetInode(NewPath)!=Followed['Inode']):
+				if Followed:
+					for JSONString in iter(Followed['File'].readline, ''):
+						Partial += JSONString
+						if Partial.endswith('\n'):
+							AddFollowedLine(Batch, Partial, Stats)
+							Partial = ''
+					if Partial:
+						AddFollowedLine(Batch, Partial, Stats)
+						Partial = ''
+					Followed['File'].close()
+					cprint('[EdX Log] [%s Data] [Follow] File rotated: %s' % (ItemClass, Followed['Path']), 'yellow')
+				Followed = OpenFollowedFile(Path, True)
+				NumRead += 1
+			elif Followed and NewPath and os.path.getsize(NewPath)<Followed['File'].tell():
+				cprint('[EdX Log] [%s Data] [Follow] File truncated: %s' % (ItemClass, Followed['Path']), 'yellow')
+				Followed['File'].seek(0)
+				Partial = ''
+			
+			# Save batch if it's waited long enough, and wait for new lines
+			if Batch and time.time()-Stats['BatchStart']>=FlushInterval:
+				FlushFollowedEvents(Batch, Sink, ItemClass, Stats)
+			if NumRead==0:
+				time.sleep(PollInterval)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		if Batch:
+			FlushFollowedEvents(Batch, Sink, ItemClass, Stats)
+		if Followed:
+			Followed['File'].close()
+	
+	print('[EdX Log] [%s Data] [Done following file] %s line(s), %s event(s) saved. Elapsed time: %s seconds.' % (ItemClass, Stats['NumLines'], Stats['NumEvents'], int(round(time.time() - StartTime))))
+	PrintAttributeWarnings()
+	
+	return Stats['NumEvents']
+
+# END DEF FollowEventFile ----------
+
+# Get path of followed file: Path itself, or newest file of directory Path (compressed and hidden files are skipped). Return None if there is no file
+def GetFollowedFilePath(Path):
+	if not os.path.isdir(Path):
+		return Path if os.path.isfile(Path) else None
+	FilePaths = [os.path.join(Path, FileName) for FileName in os.listdir(Path) if not FileName.startswith('.') and not FileName.endswith('.gz')]
+	FilePaths = [FilePath for FilePath in FilePaths if os.path.isfile(FilePath)]
+	if not FilePaths:
+		return None
+	return max(FilePaths, key=lambda FilePath: (os.path.getmtime(FilePath), FilePath))
+
+# Open followed file, at its end unless FromStart=True. Return None if there is no file yet
+def OpenFollowedFile(Path, FromStart=False):
+	FilePath = GetFollowedFilePath(Path)
+	if FilePath is None:
+		return None
+	f = open(FilePath, 'r')
+	if not FromStart:
+		f.seek(0, os.SEEK_END)
+	return {'Path' : FilePath, 'File' : f, 'Inode' : os.fstat(f.fileno()).st_ino}
+
+# Get inode of file (None if file doesn't exist)
+def GetInode(FilePath):
+	try:
+		return os.stat(FilePath).st_ino
+	except OSError:
+		return None
+
+# Add followed line to batch, and start timing batch latency with its first line
+def AddFollowedLine(Batch, JSONString, Stats):
+	Batch.append(JSONString)
+	if Stats['BatchStart'] is None:
+		Stats['BatchStart'] = time.time()
+
+# Parse batch of followed lines and save events into sink (.json.gz file or MongoDB collection). Batch is emptied
+def FlushFollowedEvents(Batch, Sink, ItemClass, Stats):
+	
+	if isinstance(Sink, basestring):
+		Events = list(IterParseEventList(Batch, ItemClass, Encode=True))
+		DetachFromParseCache(Sink)
+		Output = open(Sink, 'ab')
+		Member = gzip.GzipFile(Sink, 'wb', 9, Output)
+		for Event in Events:
+			Member.write('%s\n' % Event)
+		Member.close()
+		Output.close()
+	else:
+		Events = list(IterParseEventList(Batch, ItemClass))
+		MongoDB_writelist(Sink, Events, ItemClass)
+	
+	print('[EdX Log] [%s Data] [Follow] %s line(s), %s event(s) saved. Latency: %.1f seconds.' % (ItemClass, len(Batch), len(Events), time.time()-Stats['BatchStart']))
+	Stats['NumLines'] += len(Batch)
+	Stats['NumEvents'] += len(Events)
+	Stats['BatchStart'] = None
+	del Batch[:]
+
+# Parse Edx file of any item class and return clean JSON items
+# "Click", "Forum", and "SignUp" events are returned as a generator, so that they can be saved while the file is being parsed
+# (as JSON strings if Encode=True, see IterParseEventList)
+# Unchanged "Forum" items of a daily snapshot are skipped if the change keys of the previous snapshot are given (see GetForumChangeKeys)
+def ParseFile(LOGFilePath, ItemClass, Locate=False, KeepAlive=False, Workers=1, Encode=False, PreviousItems=None):
+
+	# Parse "mouse click", "forum activity", and "course sign up" event types
 	if ItemClass in ['Click', 'Forum', 'SignUp']:
-		ItemList = ParseEventFile(LOGFilePath, ItemClass)
-	# Parse and save "student IP/location" info
+		ItemList = IterParseEventFile(LOGFilePath, ItemClass, Workers, Encode, PreviousItems)
+	# Parse "student IP/location" info
 	elif ItemClass=='StudentIP':
 		ItemList = ParseStudentIPFile(LOGFilePath, Locate)
-	# Parse and save "video" info
+	# Parse "video" info
 	elif ItemClass=='Video':
 		ItemList = ParseVideoFile(LOGFilePath, KeepAlive)
-	# Parse and save "video" info
+	# Parse "problem" info
 	elif ItemClass=='Problem':
 		ItemList = ParseProblemFile(LOGFilePath)
 	# Return if item class is invalid
 	else:
-		cprint('[EdX Log] [Error] ParseAndReplace() - Unknown item class: %s' % ItemClass, 'red')
+		cprint('[EdX Log] [Error] ParseFile() - Unknown item class: %s' % ItemClass, 'red')
 		exit()
-	
-	# Save to JSON file if list is not empty
-	SaveListToJSON(ItemList, JSONFilePath)
-	if len(ItemList)>0:
-		return True
-	# Return with warning if list is empty
-	else:
-		cprint('[EdX Log] [%s Data] [Warning] Parsing function returned empty JSON item list. An empty file was saved.' % ItemClass, 'magenta')
-		return True
-		
-# END DEF ParseAndReplace ----------
+
+	return ItemList
+
+# END DEF ParseFile ----------
 
 # Load FILE with events (.log/.json/.mongo) and return list of JSON items
 def LoadEventFile(FilePath):
 
-	# Load compressed file of type .log.gz
-	if FilePath.endswith('.log.gz') or FilePath.endswith('.json.gz'):
-		f = gzip.open(FilePath, 'rb')
+	# Load compressed file of type .log.gz, .json.gz, .json.zst, or .json.lz4
+	if GetFileCodec(FilePath):
+		f, RawFile = OpenCompressedFile(FilePath)
 	# Load uncompressed file of type .log, .json, or .mongo
 	elif FilePath.endswith('.log') or FilePath.endswith('.json') or FilePath.endswith('.mongo'):
-		f = open(FilePath,'r')
+		f = RawFile = open(FilePath,'r')
 	# Read JSON item strings and return as list
-	JSONList = f.readlines()
+	JSONList = cStringIO.StringIO(f.read()).readlines()
 	f.close()
+	RawFile.close()
 	return JSONList
+
+# Open FILE with events (.log/.json/.mongo, optionally gzip-compressed) for reading
+def OpenEventFile(FilePath):
+	if FilePath.endswith('.gz'):
+		return gzip.open(FilePath, 'rb')
+	else:
+		return open(FilePath, 'r')
+
+# Iterate over FILE with events, reading one JSON item string at a time (constant memory)
+# Compressed files are decompressed ahead in a background thread (zlib releases the GIL while parsing goes on), see StartReadAhead
+# If NextFilePath is given, decompression of the next file of a multi-file run is started as well
+def IterEventFile(FilePath, ShowProgress=False, NextFilePath=None):
+
+	# Tables of type .sql or .csv are imported as a whole, and their rows yielded as dicts (no need to encode them as JSON strings)
+	if FilePath.endswith('.sql') or FilePath.endswith('.csv'):
+		for Row in ImportCSVTable(FilePath):
+			yield Row
+		return
+	
+	# Start decompressing this file (unless it was prefetched) and the next one. Prefetched files that are not read are dropped
+	if GetFileCodec(FilePath):
+		ReadAhead = PrefetchedFiles.pop(FilePath, None) or StartReadAhead(FilePath)
+	else:
+		ReadAhead = None
+	for PrefetchedPath in PrefetchedFiles.keys():
+		PrefetchedFiles.pop(PrefetchedPath)['Stop'].set()
+	if NextFilePath and GetFileCodec(NextFilePath) and NextFilePath!=FilePath:
+		PrefetchedFiles[NextFilePath] = StartReadAhead(NextFilePath)
+	
+	# Create progress bar (based on fraction of file read, since number of lines is unknown)
+	N = os.path.getsize(FilePath)
+	if ShowProgress and N>0:
+		PBar = progressbar.ProgressBar(maxval=N, term_width=50, widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
+	else:
+		PBar = None
+
+	if ReadAhead:
+		try:
+			for Block, Position in IterReadAhead(ReadAhead):
+				for JSONString in cStringIO.StringIO(Block):
+					yield JSONString
+				
+				# Update progress bar
+				if PBar:
+					PBar.update(min(Position, N))
+		finally:
+			ReadAhead['Stop'].set()
+	else:
+		f = OpenEventFile(FilePath)
+		try:
+			PCounter = 0
+			for JSONString in f:
+				yield JSONString
+
+				# Update progress bar
+				PCounter += 1
+				if PBar and PCounter%10000==0:
+					PBar.update(min(f.tell(), N))
+		finally:
+			f.close()
+
+	# Close progress bar
+	if PBar:
+		PBar.update(N)
+		PBar.finish()
+
+# END DEF IterEventFile ----------
+
+# Start thread decompressing compressed file ahead into a bounded queue of blocks of whole lines (see IterReadAhead). Return read-ahead
+def StartReadAhead(FilePath):
+	ReadAhead = {'FilePath' : FilePath, 'Queue' : Queue.Queue(ReadAheadQueueSize), 'Stop' : threading.Event()}
+	Thread = threading.Thread(target=ReadAheadThread, args=(ReadAhead,))
+	Thread.daemon = True
+	Thread.start()
+	return ReadAhead
+
+# Decompress compressed file into queue, as (block of lines, compressed bytes read), then (None, None) at the end or (None, error) (runs in read-ahead thread)
+def ReadAheadThread(ReadAhead):
+	
+	# Wait for free space in queue, unless reader has stopped. Return False if stopped
+	def Put(Item):
+		while not ReadAhead['Stop'].is_set():
+			try:
+				ReadAhead['Queue'].put(Item, timeout=0.1)
+				return True
+			except Queue.Full:
+				pass
+		return False
 	
+	try:
+		f, RawFile = OpenCompressedFile(ReadAhead['FilePath'])
+		try:
+			Rest = ''
+			while True:
+				Block = f.read(ReadAheadBlockSize)
+				if not Block:
+					break
+				# Blocks are cut after their last line break, and the rest is carried over to the next block
+				Block = Rest+Block
+				Cut = Block.rfind('\n')+1
+				Rest = Block[Cut:]
+				if Cut>0 and not Put((Block[:Cut], RawFile.tell())):
+					return
+			if Rest and not Put((Rest, RawFile.tell())):
+				return
+		finally:
+			f.close()
+			RawFile.close()
+		Put((None, None))
+	except Exception, e:
+		Put((None, e))
+
+# Iterate over blocks of read-ahead, as (block of lines, compressed bytes read). Errors of read-ahead thread are raised here
+def IterReadAhead(ReadAhead):
+	while True:
+		Block, Position = ReadAhead['Queue'].get()
+		if Block is None:
+			if Position is not None:
+				raise Position
+			return
+		yield Block, Position
+
 # Print FILE with events
 def PrintEventFile(FilePath):
 	JSONList = LoadEventFile(FilePath)
 	for l in JSONList:
-		printjson(json.loads(l))
+		printjson(DecodeJSON(l))
 
 # Parse FILE with events and return JSON event list
-def ParseEventFile(FilePath, ItemClass):
+def ParseEventFile(FilePath, ItemClass, Workers=1):
+	return list(IterParseEventFile(FilePath, ItemClass, Workers))
+
+# Parse FILE with events and yield clean JSON events one at a time, while the file is being read
+def IterParseEventFile(FilePath, ItemClass, Workers=1, Encode=False, PreviousItems=None):
 	
 	# Print to shell: Path of file being parsed
 	cprint('[EdX Log] [%s Data] [Parsing...] EdX Log --> Clean JSON\n%s' % (ItemClass, FilePath), 'green', 'on_blue')
@@ -332,33 +1229,25 @@ def ParseEventFile(FilePath, ItemClass):
 	# Get current time (for calculating processing time)
 	StartTime = time.time()
 	
-	# Load compressed file of type .log.gz
-	if FilePath.endswith('.log.gz'):
-		f = gzip.open(FilePath, 'rb')
-		JSONList = f.readlines()
-		f.close()
-	# Load uncompressed file of type .log or .mongo
-	elif FilePath.endswith('.log') or FilePath.endswith('.mongo'):
-		f = open(FilePath,'r')
-		JSONList = f.readlines()
-		f.close()
-	# Load table of type .sql or .csv and convert to JSON
-	elif FilePath.endswith('.sql') or FilePath.endswith('.csv'):
-		JSONList = ImportCSVFile(FilePath)
+	# Skip unchanged forum items
+	JSONIter = IterEventFile(FilePath, ShowProgress=True)
+	if PreviousItems and ItemClass=='Forum':
+		JSONIter = IterChangedForumItems(JSONIter, PreviousItems)
 	
-	# Parse ugly edx log into clean JSON list
-	CleanJSONList = ParseEventList(JSONList, ItemClass)
+	# Parse ugly edx log into clean JSON events
+	NumEvents = 0
+	for Event in IterParseEventList(JSONIter, ItemClass, Workers, Encode):
+		NumEvents += 1
+		yield Event
 	
 	# Print to shell: Number of events parsed and elapsed time
-	print('[EdX Log] [%s Data] [Done parsing file] %s event(s) parsed. Elapsed time: %s seconds.' % (ItemClass, len(CleanJSONList), int(round(time.time() - StartTime))))
-	
-	# Return clean JSON list
-	return CleanJSONList
+	print('[EdX Log] [%s Data] [Done parsing file] %s event(s) parsed. Elapsed time: %s seconds. JSON backend: %s.' % (ItemClass, NumEvents, int(round(time.time() - StartTime)), JSONBackend))
+	PrintAttributeWarnings()
 	
-# END DEF ParseEventFile ----------
+# END DEF IterParseEventFile ----------
 
 # Parse LIST of events and return a clean JSON list
-def ParseEventList(JSONList, EventClass):
+def ParseEventList(JSONList, EventClass, Workers=1):
 
 	# Return empty list if len=0
 	if len(JSONList)==0:
@@ -369,46 +1258,324 @@ def ParseEventList(JSONList, EventClass):
 	PBar = progressbar.ProgressBar(maxval=N, term_width=50, widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
 	PCounter = 0
 	
-	# Loop through list of events
 	CleanJSONList = []
-	for JSONString in JSONList:
-		
-		# Update progress bar
-		if PCounter<=N:
+	
+	# Parse chunks of events in parallel (results are merged in input order)
+	if Workers>1:
+		for NumLines, Events in IterParseEventChunks(JSONList, EventClass, Workers):
+			PCounter += NumLines
 			PBar.update(PCounter)
-		PCounter += 1
-	
-		# Parse single "mouse click" event
-		if EventClass=='Click':
-			JSONItem = json.loads(JSONString)
-			Event = ParseClickEvent(JSONItem)
-		# Parse single "forum activity" event
-		elif EventClass=='Forum':
-			JSONItem = json.loads(JSONString)
-			Event = ParseForumEvent(JSONItem)
-		# Parse single "course sign up" event
-		elif EventClass=='SignUp':
-			JSONItem = json.loads(JSONString)
-			Event = ParseSignUpEvent(JSONItem)
+			CleanJSONList.extend(Events)
+	
+	# Loop through list of events
+	else:
+		for JSONString in JSONList:
 			
-		# If event was parsed successfully, add to event list
-		if Event:
-			CleanJSONList.append(Event)
+			# Update progress bar
+			if PCounter<=N:
+				PBar.update(PCounter)
+			PCounter += 1
+		
+			# Parse single event
+			Event = ParseEventString(JSONString, EventClass)
+				
+			# If event was parsed successfully, add to event list
+			if Event:
+				CleanJSONList.append(Event)
 	
 	# Close progress bar
 	PBar.update(N)
 	PBar.finish()
+	PrintAttributeWarnings()
 	
 	# Return clean JSON list
 	return CleanJSONList
 	
 # END DEF ParseEventList ----------
+
+# Parse ITERABLE of events (e.g. lines of an open file) and yield clean JSON events
+# With Workers>1, events are parsed in a pool of processes and yielded in input order
+# With Encode=True, events are yielded as JSON strings (encoded by the workers, in the same key order as a serial run)
+def IterParseEventList(JSONIter, EventClass, Workers=1, Encode=False):
+	if Workers>1:
+		for NumLines, Events in IterParseEventChunks(JSONIter, EventClass, Workers, Encode):
+			for Event in Events:
+				yield Event
+	else:
+		for JSONString in JSONIter:
+			Event = ParseEventString(JSONString, EventClass)
+			if Event:
+				if Encode:
+					Event = EncodeJSON(Event)
+				yield Event
+
+# Parse ITERABLE of events in a pool of worker processes, and yield (number of lines, clean JSON events) per chunk, in input order
+def IterParseEventChunks(JSONIter, EventClass, Workers, Encode=False, ChunkSize=2000):
+
+	Pool = multiprocessing.Pool(Workers)
+	try:
+		# Keep a bounded number of chunks in flight, so that memory stays constant for any input size
+		Pending = deque()
+		for Chunk in ChunkIter(JSONIter, ChunkSize):
+			Pending.append((len(Chunk), Pool.apply_async(ParseEventChunk, (Chunk, EventClass, Encode))))
+			if len(Pending)>=2*Workers:
+				NumLines, Result = Pending.popleft()
+				yield NumLines, GetChunkEvents(Result)
+		
+		# Collect remaining chunks
+		while Pending:
+			NumLines, Result = Pending.popleft()
+			yield NumLines, GetChunkEvents(Result)
+		
+		Pool.close()
+		Pool.join()
+	finally:
+		Pool.terminate()
+
+# END DEF IterParseEventChunks ----------
+
+# Wait for result of ParseEventChunk, and return its events
+def GetChunkEvents(Result):
+	ChunkResult = Result.get()
+	if ChunkResult is None:
+		exit()
+	Events, Warnings = ChunkResult
+	for (Warning, AttributePath), Count in Warnings.items():
+		CountAttributeWarning(Warning, AttributePath, Count)
+	return Events
+
+# Parse CHUNK (list) of events in worker process and return (list of clean JSON events, attribute warning counters)
+def ParseEventChunk(JSONChunk, EventClass, Encode=False):
+	try:
+		AttributeWarnings.clear()
+		Events = []
+		for JSONString in JSONChunk:
+			Event = ParseEventString(JSONString, EventClass)
+			if Event:
+				if Encode:
+					Event = EncodeJSON(Event)
+				Events.append(Event)
+		# Attribute warnings are counted in the parent process
+		return Events, AttributeWarnings.copy()
+	# exit() in a worker process would leave the pool waiting forever, so pass it on to the parent process
+	except SystemExit:
+		return None
+
+# Split ITERABLE into lists of at most ChunkSize items
+def ChunkIter(Iterable, ChunkSize):
+	Chunk = []
+	for Item in Iterable:
+		Chunk.append(Item)
+		if len(Chunk)==ChunkSize:
+			yield Chunk
+			Chunk = []
+	if Chunk:
+		yield Chunk
+
+# Parse SINGLE event string of given class
+def ParseEventString(JSONString, EventClass):
+
+	# Parse single "mouse click" event (lines with a non-meaningful event type are dropped before being decoded)
+	if EventClass=='Click':
+		if not IsClickEventCandidate(JSONString):
+			return False
+		JSONItem = DecodeEvent(JSONString)
+		Event = ParseClickEvent(JSONItem)
+	# Parse single "forum activity" event
+	elif EventClass=='Forum':
+		JSONItem = DecodeEvent(JSONString)
+		Event = ParseForumEvent(JSONItem)
+	# Parse single "course sign up" event
+	elif EventClass=='SignUp':
+		JSONItem = DecodeEvent(JSONString)
+		Event = ParseSignUpEvent(JSONItem)
+	else:
+		Event = False
+
+	return Event
 	
 	
 #=========================================================
 # CLICKSTREAM EVENT PARSING FUNCTIONS
 #=========================================================
 
+# Add new EdX event type to EventTypes (e.g. RegisterEventType('Video', 'edx.video.closed_captions.shown', 'Video.Captions.Show'))
+# Forum tags are URL patterns without IDs (as the keys of EventTypes['Forum'])
+def RegisterEventType(Category, EdxEventTag, EventType):
+	global EventTypeClassifier
+	
+	# Return if category is invalid
+	if not Category in EventTypes:
+		cprint('[EdX Log] [Error] RegisterEventType() - Unknown event category: %s' % Category, 'red')
+		exit()
+	
+	EventTypes[Category][EdxEventTag] = EventType
+	
+	# Make sure that events of this type are dispatched to the right category (forum tags are URL patterns, matched by ForumEventPatterns only)
+	if Category=='Forum':
+		if not EdxEventTag+'$' in ForumEventPatterns:
+			ForumEventPatterns.append(EdxEventTag+'$')
+	else:
+		for Name, Keywords in EventCategoryKeywords:
+			if Name==Category and not any(Keyword in EdxEventTag for Keyword in Keywords):
+				Keywords.append(EdxEventTag)
+	
+	# Classifier is rebuilt on next use
+	EventTypeClassifier = None
+	EventTypeCache.clear()
+
+# Build event type classifier out of EventTypes: one compiled regex per category, plus a dict for exact event_type strings
+def BuildEventTypeClassifier():
+	global EventTypeClassifier
+	
+	# Compile alternation of tags for each category (in the order of EventTypes, which decides which tag wins)
+	Categories = []
+	for Category, Keywords in EventCategoryKeywords:
+		if Category=='Forum':
+			Pattern = re.compile(r'(%s)' % '|'.join(ForumEventPatterns))
+		else:
+			Pattern = re.compile(r'(%s)' % '|'.join(re.escape(EdxEventTag) for EdxEventTag in EventTypes[Category].keys()))
+		Categories.append((Category, Keywords, Pattern))
+	
+	# Classify plain (non-URL) tags once, so that the most common event types are found with a single dict lookup
+	Exact = {}
+	for Category, Keywords in EventCategoryKeywords:
+		if Category!='Forum':
+			for EdxEventTag in EventTypes[Category]:
+				Exact[EdxEventTag] = ClassifyEventTypePattern(EdxEventTag, Categories)
+	
+	EventTypeClassifier = {'Exact' : Exact, 'Categories' : Categories}
+	EventTypeCache.clear()
+	return EventTypeClassifier
+
+# Classify event_type field of click event. Return (category, EdX event tag, event type, thread/post ID), or None if event type is not meaningful
+def ClassifyEventType(event_type):
+	
+	Classifier = EventTypeClassifier or BuildEventTypeClassifier()
+	
+	# Exact event type (e.g. "play_video")
+	if event_type in Classifier['Exact']:
+		return Classifier['Exact'][event_type]
+	
+	# Event type containing an URL or other text (e.g. "/courses/.../discussion/threads/.../upvote")
+	return ClassifyEventTypePattern(event_type, Classifier['Categories'], EventTypeCache)
+
+# Classify event_type field with the compiled category patterns
+# Forum URLs come back many times (e.g. views of a popular thread), so their results are kept in a LRU cache if one is given
+# (other URLs, e.g. page views, are mostly unique and are dropped by the keyword test before any pattern matching)
+def ClassifyEventTypePattern(event_type, Categories, Cache=None):
+	
+	for Category, Keywords, Pattern in Categories:
+		
+		# Get category out of keywords
+		for Keyword in Keywords:
+			if Keyword in event_type:
+				break
+		else:
+			continue
+		
+		if Category=='Forum' and Cache is not None:
+			Classification = LRUCacheGet(Cache, event_type, False)
+			if Classification is False:
+				Classification = MatchEventTypePattern(event_type, Category, Pattern)
+				LRUCacheSet(Cache, event_type, Classification, EventTypeCacheSize)
+			return Classification
+		return MatchEventTypePattern(event_type, Category, Pattern)
+	
+	# Non-meaningful click event
+	return None
+
+# END DEF ClassifyEventTypePattern ----------
+
+# Parse event type of given category out of event_type field. Return (category, EdX event tag, event type, thread/post ID), or None
+def MatchEventTypePattern(event_type, Category, Pattern):
+	
+	Match = Pattern.search(event_type)
+	if not Match:
+		return None
+	EdxEventTag = Match.group(1)
+	
+	# Get event type (forum tags have their IDs stripped out first)
+	if Category=='Forum':
+		NoIDType, ItemID = NormalizeForumEventTag(EdxEventTag)
+		EventType = EventTypes['Forum'].get(NoIDType)
+	else:
+		ItemID = None
+		EventType = EventTypes[Category].get(EdxEventTag)
+	if not EventType:
+		return None
+	
+	return (Category, EdxEventTag, EventType, ItemID)
+
+# Strip out forum/thread/comment ID from forum event tag in a single pass (e.g. "threads/5419d8c6e1e1ef1d08000123/upvote" --> "threads/[^/]*/upvote")
+# Return (tag without IDs, first thread/post ID of the tag or None)
+ForumIDPattern = re.compile(r'(?<=forum/)[^/]*(?=/threads/|/inline)|[a-z0-9]{32}|[a-z0-9]{24}|[0-9]{2,10}$')
+ForumSegmentIDPattern = re.compile(r'[a-z0-9]{32}|[a-z0-9]{24}')
+def NormalizeForumEventTag(EdxEventTag):
+	ItemIDs = []
+	
+	def StripID(Match):
+		ID = Match.group(0)
+		# Forum ID in ".../forum/<forum ID>/threads/..." (may itself contain a thread ID)
+		if Match.start()>=6 and EdxEventTag[Match.start()-6:Match.start()]=='forum/' and Match.end()<len(EdxEventTag) and EdxEventTag[Match.end()]=='/':
+			IDMatch = ForumSegmentIDPattern.search(ID)
+			if IDMatch and not ItemIDs:
+				ItemIDs.append(IDMatch.group(0)[:24])
+			# Forum IDs that only partly consist of IDs are not recognised as forum IDs (same tags as the previous multi-pass stripping)
+			Stripped = ForumSegmentIDPattern.sub('[^/]*', ID)
+			if Stripped!=ID and Stripped!='[^/]*':
+				return Stripped
+		elif len(ID)>=24 and not ItemIDs:
+			ItemIDs.append(ID[:24])
+		return '[^/]*'
+	
+	NoIDType = ForumIDPattern.sub(StripID, EdxEventTag)
+	return NoIDType, (ItemIDs[0] if ItemIDs else None)
+
+# Check event_type field of raw click event line, without decoding the line. Return False only if event type can't be meaningful
+EventTypeFieldPattern = re.compile(r'"event_type"\s*:\s*"((?:[^"\\]|\\.)*)"')
+def IsClickEventCandidate(JSONString):
+	
+	if not isinstance(JSONString, basestring):
+		return True
+	
+	# Only a single plain event_type field can be checked (nested events may have their own event_type, and escaped strings need decoding)
+	Match = EventTypeFieldPattern.findall(JSONString)
+	if len(Match)!=1 or '\\' in Match[0]:
+		return True
+	
+	return ClassifyEventType(Match[0]) is not None
+
+# Find first video/problem ID (32 alphanumeric characters) in event field, without encoding it back to JSON
+# Keys and values are searched in the order in which json.dumps() writes them, so the same ID is found as in the encoded string
+ItemIDPattern = re.compile(r'[a-z0-9]{32}')
+EscapedCharPattern = re.compile(r'[^\x20-\x7e]')
+def FindItemID(Value):
+	
+	if isinstance(Value, basestring):
+		# Characters escaped by json.dumps() (e.g. "\u00e9") may be part of an ID in the encoded string
+		if EscapedCharPattern.search(Value):
+			Value = EncodeJSON(Value)
+		Match = ItemIDPattern.search(Value)
+		return Match.group(0) if Match else None
+	elif isinstance(Value, dict):
+		for Key, SubValue in Value.iteritems():
+			ID = FindItemID(Key) or FindItemID(SubValue)
+			if ID:
+				return ID
+	elif isinstance(Value, list):
+		for SubValue in Value:
+			ID = FindItemID(SubValue)
+			if ID:
+				return ID
+	elif isinstance(Value, (int, long)):
+		return FindItemID(str(Value))
+	
+	return None
+
+# Video event tags with metadata in their event field
+VideoMetadataEventTags = frozenset(['play_video', 'pause_video', 'stop_video', 'show_transcript', 'hide_transcript', 'seek_video', 'speed_change_video'])
+
 # Parse SINGLE Click Event [Depth 2]
 def ParseClickEvent(JSONItem):
 
@@ -421,60 +1588,57 @@ def ParseClickEvent(JSONItem):
 	CourseID = []
 	StudentID = []
 	ISOTime = []
-	EventType = []
 	EventID = []
 	
+	# Parse category, EdX event tag, and event type out of event_type field
+	Classification = ClassifyEventType(event_type)
+	
+	# Found meaningful event type?
+	if not Classification: # NO
+		return False
+	
+	Category, EdxEventTag, EventType, ItemID = Classification
+	
 	#=========================#
 	#   User Account Events   #
 	#=========================#
-	if 'enrollment' in event_type or 'login' in event_type:
+	if Category=='Account':
 	
-		# Parse event type out of event_type field
-		MatchedType = re.findall(r'(edx.course.enrollment.activated|students_update_enrollment|edx.course.enrollment.deactivated|edx.course.enrollment.mode_changed|edx.course.enrollment.upgrade.succeeded|accounts/login)', event_type)
-		
-		# Found meaningful event type?
-		if len(MatchedType)==0: # NO
+		# Try to get integer student ID. Return if failed
+		if not 'user_id' in JSONItem['context'] and not 'user_id' in JSONItem['event']:
 			return False
-			
-		else: # YES
-		
-			# Try to get integer student ID. Return if failed
-			if not 'user_id' in JSONItem['context'] and not 'user_id' in JSONItem['event']:
-				return False
-			elif 'user_id' in JSONItem['context'] and not 'user_id' in JSONItem['event']:
+		elif 'user_id' in JSONItem['context'] and not 'user_id' in JSONItem['event']:
+			StudentID = JSONItem['context']['user_id']
+		elif not 'user_id' in JSONItem['context'] and 'user_id' in JSONItem['event']:
+			StudentID = JSONItem['event']['user_id']
+		elif 'user_id' in JSONItem['context'] and 'user_id' in JSONItem['event']:
+			if JSONItem['context']['user_id']==JSONItem['event']['user_id']:
 				StudentID = JSONItem['context']['user_id']
-			elif not 'user_id' in JSONItem['context'] and 'user_id' in JSONItem['event']:
-				StudentID = JSONItem['event']['user_id']
-			elif 'user_id' in JSONItem['context'] and 'user_id' in JSONItem['event']:
-				if JSONItem['context']['user_id']==JSONItem['event']['user_id']:
-					StudentID = JSONItem['context']['user_id']
-				else:
-					return False
 			else:
 				return False
-			if not isinstance(StudentID, int):
-				return
+		else:
+			return False
+		if not isinstance(StudentID, int):
+			return
+	
+		# Get rest of basic event data
+		CourseID = JSONItem['context']['course_id'].replace('/','-')
+		ISOTime = JSONItem['time']
+		POSIXTime = ISO8601_to_POSIXtime(ISOTime)
+		EventID = GenerateEventID(CourseID, StudentID, ISOTime, EventType)
+		
+		# Build basic event matadata dict
+		EventMetadata = {'EventID' : EventID, 'EdxEventTag' : EdxEventTag}
+		
+		# Build event dict
+		Event = {'StudentID' : StudentID, 'TimeStamp' : {'ISO8601' : ISOTime, 'POSIX' : POSIXTime}, 'EventType' : EventType, 'EventID' : EventID, 'EventMetadata' : EventMetadata}
+		
+		# Build course event dict
+		CourseEvent = {'CourseID' : CourseID, 'Event': Event}
+		
+		# Return course event dict			
+		return CourseEvent
 		
-			# Get rest of basic event data
-			CourseID = JSONItem['context']['course_id'].replace('/','-')
-			ISOTime = JSONItem['time']
-			POSIXTime = ISO8601_to_POSIXtime(ISOTime)
-			EventType = EventTypes['Account'][MatchedType[0]]
-			EventID = GenerateEventID(CourseID, StudentID, ISOTime, EventType)
-			
-			# Build basic event matadata dict
-			EventMetadata = {'EventID' : EventID, 'EdxEventTag' : MatchedType[0]}
-			
-			# Build event dict
-			Event = {'StudentID' : StudentID, 'TimeStamp' : {'ISO8601' : ISOTime, 'POSIX' : POSIXTime}, 'EventType' : EventType, 'EventID' : EventID, 'EventMetadata' : EventMetadata}
-			
-			# Build course event dict
-			CourseEvent = {'CourseID' : CourseID, 'Event': Event}
-			
-			# Return course event dict			
-			return CourseEvent
-			
-		# END ELSE ----------
 	
 	# END IF ----------
 	
@@ -482,15 +1646,8 @@ def ParseClickEvent(JSONItem):
 	#==============================#
 	#   Video Interaction Events   #
 	#==============================#
-	elif 'video' in event_type or 'transcript' in event_type:
+	elif Category=='Video':
 		
-		# Parse event type out of event_type field
-		MatchedType = re.findall(r'(load_video|play_video|pause_video|seek_video|stop_video|speed_change_video|show_transcript|hide_transcript|transcript/download|transcript/translation/en|transcript/translation/fr|transcript/translation)', event_type)
-		
-		# Found meaningful event type?
-		if len(MatchedType)==0: # NO
-			return False
-			
 		# Basic event data available?
 		if not IsAttribute(JSONItem, ['context.course_id', 'context.user_id', 'time']): # NO
 		   return False
@@ -502,20 +1659,13 @@ def ParseClickEvent(JSONItem):
 			StudentID = GetAttribute(JSONItem, 'context.user_id')
 			ISOTime = GetAttribute(JSONItem, 'time')
 			POSIXTime = ISO8601_to_POSIXtime(ISOTime)
-			EventType = EventTypes['Video'][MatchedType[0]]
 			EventID = GenerateEventID(CourseID, StudentID, ISOTime, EventType)
 			
-			# Parse video ID out of event_type field
-			MatchedID = re.findall(r'([a-z0-9]{32})', event_type)
-			if len(MatchedID)>0:
-				VideoID = MatchedID[0]
-			else:
-				MatchedID = re.findall(r'([a-z0-9]{32})', json.dumps(JSONItem['event']))	
-				if len(MatchedID)>0:
-					VideoID = MatchedID[0]
+			# Parse video ID out of event_type field, or else out of event field
+			VideoID = FindItemID(event_type) or FindItemID(JSONItem['event'])
 			
 			# Return if failed to get video ID	
-			if 'VideoID' not in locals():
+			if not VideoID:
 				return False
 			
 			#----------------------
@@ -530,26 +1680,27 @@ def ParseClickEvent(JSONItem):
 			OldSpeed = None
 			NewSpeed = None
 			
-			# Re-parse event attribute
-			JSONItem_Event = json.loads(GetAttribute(JSONItem, 'event'))
+			# Re-parse event attribute (JSON string), only for the event types that have metadata
+			if EdxEventTag in VideoMetadataEventTags:
+				JSONItem_Event = DecodeEvent(GetAttribute(JSONItem, 'event'))
 			
 			# Get current time in video player
-			if MatchedType[0] in ['play_video', 'pause_video', 'stop_video', 'show_transcript', 'hide_transcript']:
+			if EdxEventTag in ['play_video', 'pause_video', 'stop_video', 'show_transcript', 'hide_transcript']:
 				CurrentTime = GetAttribute(JSONItem_Event, 'currentTime', IgnoreErrors=True)
 				
 			# Get old and new time when student navigates video player
-			elif MatchedType[0]=='seek_video':
+			elif EdxEventTag=='seek_video':
 				OldTime = GetAttribute(JSONItem_Event, 'old_time', IgnoreErrors=True)
 				NewTime = GetAttribute(JSONItem_Event, 'new_time', IgnoreErrors=True)
 				SeekType = GetAttribute(JSONItem_Event, 'type', IgnoreErrors=True)
 				
 			# Get old and new speed when student changes video speed
-			elif MatchedType[0]=='speed_change_video':
+			elif EdxEventTag=='speed_change_video':
 				OldSpeed = GetAttribute(JSONItem_Event, 'old_speed', IgnoreErrors=True)
 				NewSpeed = GetAttribute(JSONItem_Event, 'new_speed', IgnoreErrors=True)
 				
 			# Build basic event matadata dict
-			EventMetadata = {'EventID' : EventID, 'ParentVideoID' : VideoID, 'DepthInHierarchy' : 1, 'EdxEventTag' : MatchedType[0], 'CurrentTime' : CurrentTime, 'OldTime' : OldTime, 'NewTime' : NewTime, 'SeekType' : SeekType, 'OldSpeed' : OldSpeed, 'NewSpeed' : NewSpeed}
+			EventMetadata = {'EventID' : EventID, 'ParentVideoID' : VideoID, 'DepthInHierarchy' : 1, 'EdxEventTag' : EdxEventTag, 'CurrentTime' : CurrentTime, 'OldTime' : OldTime, 'NewTime' : NewTime, 'SeekType' : SeekType, 'OldSpeed' : OldSpeed, 'NewSpeed' : NewSpeed}
 			
 			# Build event dict
 			Event = {'StudentID' : StudentID, 'TimeStamp' : {'ISO8601' : ISOTime, 'POSIX' : POSIXTime}, 'EventType' : EventType, 'EventID' : EventID, 'EventMetadata' : EventMetadata}
@@ -567,15 +1718,8 @@ def ParseClickEvent(JSONItem):
 	#============================#
 	#   Problem Solving Events   #
 	#============================#
-	elif 'problem' in event_type:
+	elif Category=='Problem':
 		
-		# Parse event type out of event_type field
-		MatchedType = re.findall(r'(problem_check|problem_check_fail|problem_graded|problem_reset|problem_save|problem_show|reset_problem|reset_problem_fail|save_problem_fail|save_problem_success)', event_type)
-		
-		# Found meaningful event type?
-		if len(MatchedType)==0: # NO
-			return False
-			
 		# Basic event data available?
 		if not IsAttribute(JSONItem, ['context.course_id', 'context.user_id', 'time']): # NO
 		   return False
@@ -587,29 +1731,22 @@ def ParseClickEvent(JSONItem):
 			StudentID = JSONItem['context']['user_id']
 			ISOTime = JSONItem['time']
 			POSIXTime = ISO8601_to_POSIXtime(ISOTime)
-			EventType = EventTypes['Problem'][MatchedType[0]]
 			EventID = GenerateEventID(CourseID, StudentID, ISOTime, EventType)
 			
-			# Parse problem ID out of event_type field
-			MatchedID = re.findall(r'([a-z0-9]{32})', event_type)
-			if len(MatchedID)>0:
-				ProblemID = MatchedID[0]
-			else:
-				MatchedID = re.findall(r'([a-z0-9]{32})', json.dumps(JSONItem['event']))	
-				if len(MatchedID)>0:
-					ProblemID = MatchedID[0]
+			# Parse problem ID out of event_type field, or else out of event field
+			ProblemID = FindItemID(event_type) or FindItemID(JSONItem['event'])
 					
 			# Return if failed to get problem ID
-			if 'ProblemID' not in locals():
+			if not ProblemID:
 				return False
 				
 			# Build basic event matadata dict
-			EventMetadata = {'EventID' : EventID, 'ParentProblemID' : ProblemID, 'DepthInHierarchy' : 1, 'EdxEventTag' : MatchedType[0]}
+			EventMetadata = {'EventID' : EventID, 'ParentProblemID' : ProblemID, 'DepthInHierarchy' : 1, 'EdxEventTag' : EdxEventTag}
 			
 			#---------------------------
 			# "Problem Check" event type
 			#---------------------------
-			if MatchedType[0]=='problem_check':
+			if EdxEventTag=='problem_check':
 			
 				# Return if no answer and submission information available
 				if not 'module' in JSONItem['context'].keys() or not 'submission' in JSONItem['event'].keys():
@@ -687,7 +1824,7 @@ def ParseClickEvent(JSONItem):
 			# Build course event dict
 			CourseEvent = {'CourseID' : CourseID, 'Event': Event}
 			
-			#if (MatchedType[0]=='problem_check') and ('EPFLx/CS305/2014' in CourseID) and POSIXTime>1414764000.000 and POSIXTime<1414778400.000:
+			#if (EdxEventTag=='problem_check') and ('EPFLx/CS305/2014' in CourseID) and POSIXTime>1414764000.000 and POSIXTime<1414778400.000:
 				#printjson(CourseEvent)
 				#print '\n\n\n\n\n\n\n\n\n'
 				
@@ -701,60 +1838,34 @@ def ParseClickEvent(JSONItem):
 	#===========================#
 	#   Forum Activity Events   #
 	#===========================#
-	elif 'discussion' in event_type or 'forum' in event_type:
+	elif Category=='Forum':
 		
-		# Parse event type out of event_type field
-		MatchedType = re.findall(r'(comments/[^/]*/delete$|comments/[^/]*/flagAbuse$|comments/[^/]*/reply$|comments/[^/]*/unFlagAbuse$|comments/[^/]*/unvote$|comments/[^/]*/update$|comments/[^/]*/upvote$|forum$|forum\)$|forum/$|forum/[^/]*/inline$|forum/[^/]*/threads/[^/]*$|forum/[^/]*/threads/create$|forum/i4x-edx-templates-course-Empty/inline$|forum/i4x-edx-templates-course-Empty/threads/[^/]*$|forum/i4x-EPFLx-[^\-]*-course-[^/]*/threads/[^/]*$|forum/search$|forum/undefined/threads/[^/]*$|forum/users/[^/]*$|i4x-edx-templates-course-Empty/threads/create$|threads/[^/]*/delete$|threads/[^/]*/flagAbuse$|threads/[^/]*/follow$|threads/[^/]*/pin$|threads/[^/]*/reply$|threads/[^/]*/unFlagAbuse$|threads/[^/]*/unfollow$|threads/[^/]*/unvote$|threads/[^/]*/update$|threads/[^/]*/upvote$|upload)', event_type)
-		
-		# Found meaningful event type?
-		if len(MatchedType)==0: # NO
-			return False
-			
 		# Basic event data available?
 		if not IsAttribute(JSONItem, ['context.course_id', 'context.user_id', 'time']): # NO
 		   return False
 			
 		else: # YES
 			
-			# Strip out forum/thread/comment ID from event type
-			NoIDType = MatchedType[0]
-			for match in re.findall(r'([a-z0-9]{32})', NoIDType):
-				NoIDType = NoIDType.replace(match, '[^/]*')
-			for match in re.findall(r'([a-z0-9]{24})', NoIDType):
-				NoIDType = NoIDType.replace(match, '[^/]*')
-			for match in re.findall(r'([0-9]{2,10}$)', NoIDType):
-				NoIDType = NoIDType.replace(match, '[^/]*')
-			for match in re.findall(r'(forum/[^/]*/threads/)', NoIDType):
-				NoIDType = NoIDType.replace(match, 'forum/[^/]*/threads/')
-			for match in re.findall(r'(forum/[^/]*/inline)', NoIDType):
-				NoIDType = NoIDType.replace(match, 'forum/[^/]*/inline')
-			
-			# Get basic event data
+			# Get basic event data (event type and thread/post ID were found while stripping out IDs from EdX event tag, see NormalizeForumEventTag)
 			CourseID = JSONItem['context']['course_id'].replace('/','-')
 			StudentID = JSONItem['context']['user_id']
 			ISOTime = JSONItem['time']
 			POSIXTime = ISO8601_to_POSIXtime(ISOTime)
-			if NoIDType in EventTypes['Forum'].keys():
-				EventType = EventTypes['Forum'][NoIDType]
-			else:
-				return False
 			EventID = GenerateEventID(CourseID, StudentID, ISOTime, EventType)
 			
 			# Try to get IDs and build event matadata dict. Return if failed
 			if 'Forum.Thread' in EventType:
-				Match = re.findall(r'([a-z0-9]{24})', MatchedType[0])
-				if len(Match)==0:
+				if not ItemID:
 					return False
-				ThreadID = Match[0]
-				EventMetadata = {'EventID' : EventID, 'ParentThreadID' : ThreadID, 'DepthInHierarchy' : 2, 'EdxEventTag' : MatchedType[0]}
+				ThreadID = ItemID
+				EventMetadata = {'EventID' : EventID, 'ParentThreadID' : ThreadID, 'DepthInHierarchy' : 2, 'EdxEventTag' : EdxEventTag}
 			elif 'Forum.Post' in EventType:
-				Match = re.findall(r'([a-z0-9]{24})', MatchedType[0])
-				if len(Match)==0:
+				if not ItemID:
 					return False
-				PostID = Match[0]
-				EventMetadata = {'EventID' : EventID, 'ParentPostID' : PostID, 'DepthInHierarchy' : 3, 'EdxEventTag' : MatchedType[0]}			
+				PostID = ItemID
+				EventMetadata = {'EventID' : EventID, 'ParentPostID' : PostID, 'DepthInHierarchy' : 3, 'EdxEventTag' : EdxEventTag}			
 			else:
-				EventMetadata = {'EventID' : EventID, 'ParentForumID' : None, 'DepthInHierarchy' : 1, 'EdxEventTag' : MatchedType[0]}
+				EventMetadata = {'EventID' : EventID, 'ParentForumID' : None, 'DepthInHierarchy' : 1, 'EdxEventTag' : EdxEventTag}
 			
 			# Build event dict
 			Event = {'StudentID' : StudentID, 'TimeStamp' : {'ISO8601' : ISOTime, 'POSIX' : POSIXTime}, 'EventType' : EventType, 'EventID' : EventID, 'EventMetadata' : EventMetadata}
@@ -969,6 +2080,59 @@ def ParseForumEvent(JSONItem):
 
 # END DEF ParseForumEvent ----------
 
+# Get change keys of forum snapshot (.mongo file), to skip its unchanged items in the next snapshot (see IterChangedForumItems)
+# Items are keyed on their "updated_at" field if ChangeKey='UpdatedAt', or on a hash of their whole content if ChangeKey='Hash'
+# (votes and comment counts may change without "updated_at" changing)
+def GetForumChangeKeys(FilePath, ChangeKey='Hash'):
+	Items = {}
+	for JSONString in IterEventFile(FilePath):
+		ID, Key = ReadForumChangeKey(JSONString, ChangeKey)
+		if ID is not None:
+			Items[ID] = Key
+	return {'ChangeKey' : ChangeKey, 'Items' : Items}
+
+# Yield forum items (raw .mongo lines) that are new or modified since the previous snapshot
+def IterChangedForumItems(JSONIter, PreviousItems):
+	
+	ChangeKey = PreviousItems['ChangeKey']
+	Items = PreviousItems['Items']
+	NumSkipped = 0
+	for JSONString in JSONIter:
+		ID, Key = ReadForumChangeKey(JSONString, ChangeKey)
+		if ID is not None and Items.get(ID)==Key:
+			NumSkipped += 1
+			continue
+		yield JSONString
+	
+	print('[EdX Log] [Forum Data] %s unchanged item(s) skipped.' % NumSkipped)
+
+# Forum item fields read by ReadForumChangeKey
+ForumItemIDPattern = re.compile(r'"_id"\s*:\s*\{\s*"\$oid"\s*:\s*"([0-9a-fA-F]+)"\s*\}')
+ForumUpdatedAtPattern = re.compile(r'"updated_at"\s*:\s*\{\s*"\$date"\s*:\s*(-?\d+)\s*\}')
+
+# Read (ID, change key) of forum item (raw .mongo line). Return (None, None) if item has no ID
+def ReadForumChangeKey(JSONString, ChangeKey='Hash'):
+	
+	if isinstance(JSONString, basestring):
+		Match = ForumItemIDPattern.findall(JSONString)
+		if ChangeKey=='Hash' and len(Match)==1:
+			return Match[0], hashlib.md5(JSONString.rstrip('\r\n')).hexdigest()
+		UpdatedAt = ForumUpdatedAtPattern.findall(JSONString)
+		if len(Match)==1 and len(UpdatedAt)==1:
+			return Match[0], int(UpdatedAt[0])
+	
+	# Decode item if fields can't be matched unambiguously (raw lines are hashed as in the fast path, so that an item's hash doesn't depend on the path it takes)
+	try:
+		JSONItem = DecodeEvent(JSONString)
+		ID = JSONItem['_id']['$oid']
+		if ChangeKey=='Hash':
+			if isinstance(JSONString, basestring):
+				return ID, hashlib.md5(JSONString.rstrip('\r\n')).hexdigest()
+			return ID, hashlib.md5(EncodeJSON(JSONItem, sort_keys=True)).hexdigest()
+		return ID, int(JSONItem['updated_at']['$date'])
+	except:
+		return None, None
+
 #=========================================================
 # STUDENT SIGN-UP PARSING FUNCTIONS
 #=========================================================
@@ -1016,33 +2180,118 @@ def ParseSignUpEvent(JSONItem):
 # STUDENT IP PARSING FUNCTIONS
 #=========================================================
 
+# Parse FILE with events and return clean StudentIP items, one per distinct (user ID, username, IP)
+# Lines are streamed, and only the fields needed are read out of them (see ReadStudentIPFields)
 def ParseStudentIPFile(FilePath, Locate=False):
 
 	cprint('[EdX Log] [IP Lookup] [Parsing...] EdX Log --> Clean JSON\n%s' % FilePath, 'green', 'on_blue')
 	StartTime = time.time()
 	
-	ItemList = []
-	JSONList = LoadEventFile(FilePath)
+	ItemSet = set()
+	for JSONString in IterEventFile(FilePath):
+		Fields = ReadStudentIPFields(JSONString)
+		if Fields:
+			ItemSet.add(Fields[:3])
 	
-	for l in JSONList:
-		
-		JSON = json.loads(l)
-		
-		try:
-			NewItem = [JSON['context']['user_id'], JSON['username'], JSON['ip']]
-			if not NewItem in ItemList:
-				ItemList.append(NewItem)
-		except:
-			pass
+	JSONListClean = ParseStudentIPList(list(ItemSet), Locate)
+	print('\r[EdX Log] [IP Lookup] [Done parsing file] %s item(s) parsed. Elapsed time: %s seconds.' % (len(ItemSet), int(round(time.time() - StartTime))))
 	
+	return JSONListClean
+
+# Parse LIST of files with events (e.g. daily logs) and return clean StudentIP items, one per distinct (user ID, username, IP) of all files
+# Items have first/last time the student was seen with the IP, and number of events with it. Files are streamed one after the other
+def ParseStudentIPFileList(FileList, Locate=False):
+
+	cprint('[EdX Log] [IP Lookup] [Parsing...] EdX Log --> Clean JSON\n%s file(s)' % len(FileList), 'green', 'on_blue')
+	StartTime = time.time()
+	
+	# (user ID, username, IP) -> [first POSIX time, first ISO time, last POSIX time, last ISO time, number of events]
+	ItemStats = {}
+	for FileNumber, FilePath in enumerate(FileList):
+		NextFilePath = FileList[FileNumber+1] if FileNumber+1<len(FileList) else None
+		for JSONString in IterEventFile(FilePath, NextFilePath=NextFilePath):
+			Fields = ReadStudentIPFields(JSONString)
+			if not Fields:
+				continue
+			
+			ISOTime = Fields[3]
+			try:
+				POSIXTime = ISO8601_to_POSIXtime(ISOTime)
+			except (ValueError, TypeError, AttributeError):
+				POSIXTime = None
+			
+			Stats = ItemStats.get(Fields[:3])
+			if Stats is None:
+				ItemStats[Fields[:3]] = [POSIXTime, ISOTime, POSIXTime, ISOTime, 1]
+				continue
+			Stats[4] += 1
+			if POSIXTime is None:
+				continue
+			if Stats[0] is None or POSIXTime<Stats[0]:
+				Stats[0:2] = [POSIXTime, ISOTime]
+			if Stats[2] is None or POSIXTime>Stats[2]:
+				Stats[2:4] = [POSIXTime, ISOTime]
+	
+	ItemList = sorted(ItemStats)
 	JSONListClean = ParseStudentIPList(ItemList, Locate)
-	#print 'Exiting without saving'
-	#exit()
-	print('\r[EdX Log] [IP Lookup] [Done parsing file] %s item(s) parsed. Elapsed time: %s seconds.' % (len(ItemList), int(round(time.time() - StartTime))))
+	for Item, JSONCleanItem in zip(ItemList, JSONListClean):
+		FirstPOSIX, FirstISO, LastPOSIX, LastISO, Count = ItemStats[Item]
+		JSONCleanItem.update({
+			'FirstSeen' : {'ISO8601' : FirstISO, 'POSIX' : FirstPOSIX},
+			'LastSeen' : {'ISO8601' : LastISO, 'POSIX' : LastPOSIX},
+			'EventCount' : Count
+		})
 	
-	return JSONListClean
+	print('\r[EdX Log] [IP Lookup] [Done parsing files] %s item(s) parsed. Elapsed time: %s seconds.' % (len(ItemList), int(round(time.time() - StartTime))))
 	
+	return JSONListClean
 
+# Fields of raw log line read by ReadStudentIPFields: key -> pattern of value following the key
+# User ID is read from the context field, which may hold one level of nested objects
+JSONValueRegex = r'(null|-?\d+(?![.eE\d])|"(?:[^"\\]|\\.)*")'
+JSONStringRegex = r'"(?:[^"\\]|\\.)*"'
+StudentIPFieldPatterns = [
+	('"context"', re.compile(r'\s*:\s*\{(?:%s|\{(?:%s|[^{}"])*\}|[^{}"])*?"user_id"\s*:\s*%s' % (JSONStringRegex, JSONStringRegex, JSONValueRegex))),
+	('"username"', re.compile(r'\s*:\s*%s' % JSONValueRegex)),
+	('"ip"', re.compile(r'\s*:\s*%s' % JSONValueRegex)),
+	('"time"', re.compile(r'\s*:\s*%s' % JSONValueRegex))
+]
+
+# Read (user ID, username, IP, time) out of raw log line. Return None if line has no user ID, username, or IP (time is None if missing)
+# Fields are matched without decoding the line. The line is only decoded if a field can't be matched unambiguously (key found more than once, or value of other type)
+def ReadStudentIPFields(JSONString):
+	
+	if isinstance(JSONString, basestring):
+		Values = []
+		for Key, Pattern in StudentIPFieldPatterns:
+			Pos = JSONString.find(Key)
+			if Pos<0 or JSONString.find(Key, Pos+1)>=0:
+				break
+			Match = Pattern.match(JSONString, Pos+len(Key))
+			if not Match:
+				break
+			Values.append(DecodeJSONValue(Match.group(1)))
+		else:
+			return tuple(Values)
+	
+	JSON = DecodeEvent(JSONString)
+	try:
+		Fields = (JSON['context']['user_id'], JSON['username'], JSON['ip'], JSON.get('time'))
+		hash(Fields[:3])
+		return Fields
+	except:
+		return None
+
+# Decode JSON value matched in raw line (plain strings, integers, and null are converted directly)
+def DecodeJSONValue(JSONValue):
+	if JSONValue=='null':
+		return None
+	elif JSONValue[0]=='"':
+		if '\\' in JSONValue or EscapedCharPattern.search(JSONValue):
+			return DecodeJSON(JSONValue)
+		return JSONValue[1:-1]
+	else:
+		return int(JSONValue)
 
 def ParseStudentIPList(ItemList, Locate=False):
 
@@ -1054,27 +2303,34 @@ def ParseStudentIPList(ItemList, Locate=False):
 	if N>0:
 		#PBar = progressbar.ProgressBar(maxval=N, term_width=50, widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
 		PCounter = 0
+		
+		# Locate all IPs at once
+		ItemList = sorted(ItemList)
+		if Locate:
+			Locations = LocateIPList([Item[2] for Item in ItemList])
 	
-		for Item in sorted(ItemList):
+		for Item in ItemList:
 		
-			JSONCleanItem = ParseStudentIPItem(Item, Locate)
+			JSONCleanItem = ParseStudentIPItem(Item)
+			if Locate:
+				JSONCleanItem['Location'] = Locations[PCounter]
 			
 			# Update progress bar
 			#if PCounter<=N:
 			#	PBar.update(PCounter)
 			PCounter += 1
 			
+			# Progress is printed every 10000 IPs (printing every IP would take longer than locating them)
 			if Locate:
-				if JSONCleanItem['Location']:
+				if not JSONCleanItem['Location']:
+					cprint('[ERROR] ParseStudentIPList() - IP not found in database: %s' % Item[2], 'red')
+					exit()
+				if PCounter%10000==0 or PCounter==N:
 					PercentageStr = '['+str(int(round(float(PCounter)/float(N)*100)))+'%] '
 					MSG = PercentageStr+colored('IP located: %s --> %s, %s' % (JSONCleanItem['IP'], JSONCleanItem['Location']['City'], JSONCleanItem['Location']['Country']['Name']), 'green')
 					MSG = str.ljust(MSG, 100)
 					sys.stdout.write('\r'+MSG+' '*len(PercentageStr))
 					sys.stdout.flush()
-				else:
-					cprint('[ERROR] ParseStudentIPList() - IP not found in database: %s' % Item[2], 'red')
-					exit()
-					
 			
 					
 			JSONListClean.append(JSONCleanItem)
@@ -1102,15 +2358,7 @@ def ParseStudentIPItem(Item, Locate=False):
 	
 	# Lookup IP if requested
 	if Locate:
-		for FromCache in [True, False]:
-			for Depth in [1,2,3,4]:
-				# Try to locate IP in database with given depth
-				Location = IPLookup(JSONClean['IP'], Depth, FromCache)
-				# Exit loop if valid location found
-				if Location:
-					break
-			if Location:
-				break
+		Location = LocateIP(JSONClean['IP'])
 			
 	# Add location JSON field to output JSON item
 	JSONClean.update({'Location' : Location})
@@ -1118,160 +2366,386 @@ def ParseStudentIPItem(Item, Locate=False):
 	# Return clean JSON item
 	return JSONClean
 
-# IP Lookup
-def IPLookup(IP, Depth, FromCache):
+# Locate IP. Return location JSON, or None if IP is not in database
+# IPs are looked up in the in-process cache, then in the persistent IP cache, and only then in the IP database
+def LocateIP(IP):
 	
-	# Check if IP database exists
-	if not os.path.isfile(IPTablePath):
-		cprint('[EdX Log] [StudentIP Data] [Error] IPLookup() - IP database file not found: %s' % IPTablePath, 'red')
+	Row = LRUCacheGet(IPLocationCache, IP)
+	if Row is None:
+		Row = GetCachedIPLocations([IP]).get(IP)
+		if Row is None:
+			Row = FindIPRange(IP)
+			if Row is None:
+				return None
+			SaveIPLocations({IP : Row})
+		LRUCacheSet(IPLocationCache, IP, Row, IPLocationCacheSize)
+	
+	return BuildLocationJSON(*Row)
+
+# Locate list of IPs. Return list of location JSONs (None for IPs not in database), in the same order
+# Location JSON is built once per IP range (IPs of the same range share the same location dict)
+def LocateIPList(IPList):
+	
+	# IPs located before, in this process or by any process on earlier runs (recency in the in-process cache is updated below)
+	Rows = {}
+	for IP in IPList:
+		Row = IPLocationCache.get(IP)
+		if Row is not None:
+			Rows[IP] = Row
+	Missing = list(set(IP for IP in IPList if not IP in Rows))
+	if Missing:
+		Rows.update(GetCachedIPLocations(Missing))
+		Missing = [IP for IP in Missing if not IP in Rows]
+	
+	# New IPs are looked up in the IP database, and added to the persistent cache
+	if Missing:
+		NewRows = dict((IP, Row) for IP, Row in zip(Missing, FindIPRangeList(Missing)) if Row is not None)
+		SaveIPLocations(NewRows)
+		Rows.update(NewRows)
+	
+	# Keep (at most IPLocationCacheSize) located IPs in the in-process cache
+	for IP, Row in itertools.islice(Rows.iteritems(), IPLocationCacheSize):
+		LRUCacheSet(IPLocationCache, IP, Row, IPLocationCacheSize)
+	
+	Locations = []
+	RangeLocations = {}
+	for IP in IPList:
+		Row = Rows.get(IP)
+		if Row is None:
+			Locations.append(None)
+			continue
+		if not Row[0] in RangeLocations:
+			RangeLocations[Row[0]] = BuildLocationJSON(*Row)
+		Locations.append(RangeLocations[Row[0]])
+	
+	return Locations
+
+# END DEF LocateIPList ----------
+
+# Find IP range of IP in the in-memory IP database. Return (start IP, end IP, location fields), or None if IP is not in database
+def FindIPRange(IP):
+	
+	Table = IPTable or LoadIPTable()
+	
+	IPInt = IPToInt(IP)
+	if IPInt is None:
+		return None
+	
+	# Last IP range starting before IP (ranges of the IP database don't overlap)
+	if numpy is None:
+		i = bisect_right(Table['Starts'], IPInt) - 1
+	else:
+		i = int(numpy.searchsorted(Table['Starts'], numpy.uint32(IPInt), side='right')) - 1
+	if i<0 or Table['Ends'][i]<IPInt:
+		return None
+	
+	return GetIPTableRow(Table, i)
+
+# Find IP ranges of list of IPs in the in-memory IP database, in the same order (None for IPs not in database)
+# All IPs are looked up with a single NumPy searchsorted() if NumPy is available
+def FindIPRangeList(IPList):
+	
+	if numpy is None:
+		return [FindIPRange(IP) for IP in IPList]
+	
+	Table = IPTable or LoadIPTable()
+	
+	IPInts = [IPToInt(IP) for IP in IPList]
+	IsValid = numpy.array([IPInt is not None for IPInt in IPInts], dtype='bool')
+	IPInts = numpy.array([IPInt or 0 for IPInt in IPInts], dtype='uint32')
+	
+	# Index of last IP range starting before each IP (ranges of the IP database don't overlap)
+	Indexes = numpy.searchsorted(Table['Starts'], IPInts, side='right').astype('int64') - 1
+	Found = IsValid & (Indexes>=0) & (Table['Ends'][numpy.maximum(Indexes, 0)]>=IPInts)
+	
+	Rows = [None]*len(IPList)
+	RangeRows = {}
+	for i in numpy.flatnonzero(Found):
+		Index = Indexes[i]
+		if not Index in RangeRows:
+			RangeRows[Index] = GetIPTableRow(Table, Index)
+		Rows[i] = RangeRows[Index]
+	
+	return Rows
+
+# Get row of IP database: (start IP, end IP, location fields)
+def GetIPTableRow(Table, Index):
+	return (IntToIP(Table['Starts'][Index]), IntToIP(Table['Ends'][Index]), tuple(Values[Codes[Index]] for Codes, Values in Table['Columns']))
+
+# END DEF FindIPRangeList ----------
+
+# Open persistent IP cache (created if it doesn't exist). Cached IPs are dropped if the IP database has changed since they were located
+def OpenIPCache():
+	global IPCacheConnection
+	
+	if IPCacheConnection and IPCacheConnection[0]==os.getpid():
+		return IPCacheConnection[1]
+	
+	try:
+		Connection = sqlite3.connect(IPCachePath, timeout=600)
+		Connection.text_factory = str
+		# Readers don't block the writer (not supported on all file systems)
+		try:
+			Connection.execute('PRAGMA journal_mode=WAL')
+			Connection.execute('PRAGMA synchronous=NORMAL')
+		except sqlite3.DatabaseError:
+			pass
+		with Connection:
+			# IP -> start of its IP range, and IP range -> location (ranges of the IP database don't overlap)
+			Connection.execute('CREATE TABLE IF NOT EXISTS IPLocations (IP TEXT PRIMARY KEY, StartIP TEXT) WITHOUT ROWID')
+			Connection.execute('CREATE TABLE IF NOT EXISTS IPRanges (StartIP TEXT PRIMARY KEY, EndIP TEXT, CountryCode TEXT, District TEXT, City TEXT, Latitude TEXT, Longitude TEXT, TimeZoneOffset TEXT, TimeZoneName TEXT) WITHOUT ROWID')
+			Connection.execute('CREATE TABLE IF NOT EXISTS Metadata (Key TEXT PRIMARY KEY, Value TEXT)')
+			IPTableVersion = GetIPTableVersion()
+			if IPTableVersion:
+				Row = Connection.execute("SELECT Value FROM Metadata WHERE Key='IPTableVersion'").fetchone()
+				if not Row or Row[0]!=IPTableVersion:
+					Connection.execute('DELETE FROM IPLocations')
+					Connection.execute('DELETE FROM IPRanges')
+					Connection.execute("INSERT OR REPLACE INTO Metadata VALUES ('IPTableVersion', ?)", (IPTableVersion,))
+	except sqlite3.Error, e:
+		cprint('[EdX Log] [StudentIP Data] [Error] OpenIPCache() - Could not open IP cache: %s (%s)' % (IPCachePath, e), 'red')
 		exit()
 	
-		
-	IPArray = re.findall(r'(\d*).(\d*).(\d*).(\d*)', IP)[0]
+	IPCacheConnection = (os.getpid(), Connection)
+	return Connection
+
+# END DEF OpenIPCache ----------
+
+# Get IPs of list from persistent IP cache. Return dict (IP -> (start IP, end IP, location fields)) of cached IPs
+def GetCachedIPLocations(IPList):
 	
-	# Create IP cache file if it doesn't exist
-	if not os.path.isfile('.ipcache'):
-		open('.ipcache', 'a').close()
-		
-	# Create IP-range cache file if it doesn't exist
-	if not os.path.isfile('.iprangecache'):
-		open('.iprangecache', 'a').close()
+	Connection = OpenIPCache()
 	
-	#----------------------------
-	# Look up IP in IP Cache File
-	#----------------------------
-	StartTime = time.time()
+	# Get start of IP range of each IP
+	# Long lists are matched against the whole cache (a full scan is much faster than as many indexed lookups)
+	RangeStarts = {}
+	if len(IPList)>10000 and len(IPList)*4>Connection.execute('SELECT COUNT(*) FROM IPLocations').fetchone()[0]:
+		IPSet = set(IPList)
+		for IP, StartIP in Connection.execute('SELECT IP, StartIP FROM IPLocations'):
+			if IP in IPSet:
+				RangeStarts[IP] = StartIP
+	else:
+		# IPs are sorted so that consecutive lookups hit the same pages of the cache
+		for Chunk in ChunkIter(sorted(IPList), 500):
+			Query = 'SELECT IP, StartIP FROM IPLocations WHERE IP IN (%s)' % ','.join(['?']*len(Chunk))
+			RangeStarts.update(Connection.execute(Query, Chunk))
 	
-	pipe = subprocess.Popen(['grep', IP+' : ', '.ipcache'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-	stdout, stderr = pipe.communicate()
+	# Get IP ranges (one row per IP range, shared by all its IPs)
+	Ranges = {}
+	for Chunk in ChunkIter(sorted(set(RangeStarts.itervalues())), 500):
+		Query = 'SELECT * FROM IPRanges WHERE StartIP IN (%s)' % ','.join(['?']*len(Chunk))
+		for Row in Connection.execute(Query, Chunk):
+			Ranges[Row[0]] = (Row[0], Row[1], Row[2:])
 	
-	if len(stdout)>1:
+	return dict((IP, Ranges[StartIP]) for IP, StartIP in RangeStarts.iteritems() if StartIP in Ranges)
 
-		LocationItem = re.findall(r'\s\:\s([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)', stdout)[0]
-		
-		LocationJSON = {
-			'LocalIPRange' : {
-				'Start' : LocationItem[0],
-				'End'	: LocationItem[1]
-			},
-			'Country' : {
-				'Code' : LocationItem[2],
-				'Name' : GetCountryName(LocationItem[2])
-			},
-			'District' : LocationItem[3],
-			'City' : LocationItem[4],
-			'Coordinates' : {
-				'Latitude' : LocationItem[5],
-				'Longitude' : LocationItem[6]
-			},
-			'TimeZone' : {
-				'Offset' : LocationItem[7],
-				'Name' : LocationItem[8].replace('\n','')
-			}
-		}
-		return LocationJSON
+# Add located IPs (dict IP -> (start IP, end IP, location fields)) to persistent IP cache
+def SaveIPLocations(Rows):
+	
+	if not Rows:
+		return
+	
+	Connection = OpenIPCache()
+	with Connection:
+		Ranges = dict((Row[0], Row) for Row in Rows.itervalues())
+		Connection.executemany('INSERT OR REPLACE INTO IPRanges VALUES (?,?,?,?,?,?,?,?,?)', ((StartIP, EndIP) + Location for StartIP, EndIP, Location in Ranges.itervalues()))
+		Connection.executemany('INSERT OR REPLACE INTO IPLocations VALUES (?,?)', ((IP, Row[0]) for IP, Row in Rows.iteritems()))
+
+# Location columns of IP database (dictionary-encoded: one code per IP range, and one list of distinct values per column)
+IPTableColumns = ['CountryCode', 'District', 'City', 'Latitude', 'Longitude', 'TimeZoneOffset', 'TimeZoneName']
+
+# Load IP database into an index sorted by range start: {'Starts' : [...], 'Ends' : [...], 'Columns' : [(codes, values) for each location column]}
+# With NumPy, the index is memory-mapped from the binary copy of the IP database (built once), so that all processes share the same pages
+def LoadIPTable():
+	global IPTable
+	
+	StartTime = time.time()
 	
+	if numpy is None:
+		Starts, Ends, Columns = ReadIPTableCSV()
+		IPTable = {'Starts' : Starts, 'Ends' : Ends, 'Columns' : Columns}
 	else:
+		BinaryPath = IPTableBinaryPath or IPTablePath+'.bin'
+		if not IsIPTableFileCurrent(BinaryPath):
+			BuildIPTableFile(BinaryPath)
+		IPTable = {
+			'Starts' : LoadMappedArray(os.path.join(BinaryPath, 'Starts.npy')),
+			'Ends' : LoadMappedArray(os.path.join(BinaryPath, 'Ends.npy')),
+			'Columns' : [(LoadMappedArray(os.path.join(BinaryPath, Column+'.npy')), ReadTextFile(os.path.join(BinaryPath, Column+'.txt')).split('\n')) for Column in IPTableColumns]
+		}
+	
+	print('[EdX Log] [StudentIP Data] IP database loaded: %s IP range(s). Elapsed time: %s seconds.' % (len(IPTable['Starts']), int(round(time.time() - StartTime))))
+	
+	return IPTable
+
+# END DEF LoadIPTable ----------
+
+# Read IP database (lines "start IP,end IP,country code,district,city,latitude,longitude,time zone offset,time zone name")
+# Return (range starts, range ends, [(codes, values) for each location column]), sorted by range start
+def ReadIPTableCSV():
+	
+	# Check if IP database exists
+	if not os.path.isfile(IPTablePath):
+		cprint('[EdX Log] [StudentIP Data] [Error] LoadIPTable() - IP database file not found: %s' % IPTablePath, 'red')
+		exit()
+	
+	Ranges = []
+	f = open(IPTablePath, 'r')
+	for Line in f:
+		Fields = Line.rstrip('\r\n').split(',')
+		if len(Fields)<9:
+			continue
+		Start = IPToInt(Fields[0])
+		End = IPToInt(Fields[1])
+		if Start is None or End is None:
+			continue
+		Ranges.append((Start, End, Fields[2:9]))
+	f.close()
+	
+	Ranges.sort(key=lambda Range: Range[0])
+	
+	# Many IP ranges have the same country, city, etc., which are stored only once
+	Columns = []
+	for i in range(len(IPTableColumns)):
+		ValueCodes = {}
+		Codes = [ValueCodes.setdefault(Range[2][i], len(ValueCodes)) for Range in Ranges]
+		Values = sorted(ValueCodes, key=ValueCodes.get)
+		Columns.append((Codes, Values))
+	
+	return [Range[0] for Range in Ranges], [Range[1] for Range in Ranges], Columns
+
+# END DEF ReadIPTableCSV ----------
+
+# Build binary copy of IP database: one directory with range starts/ends (uint32), and codes (uint32) and values (text, one per line) of each location column
+def BuildIPTableFile(BinaryPath):
+	
+	# Only one process builds the binary copy, the others wait for it
+	LockFile = open(BinaryPath+'.lock', 'a')
+	fcntl.flock(LockFile, fcntl.LOCK_EX)
+	try:
+		if IsIPTableFileCurrent(BinaryPath):
+			return
 		
-		StartTime = time.time()
-		if FromCache:
-			if Depth==1:
-				Command = ['grep', '[^0-9]%s\.%s\.%s\.[0-9]*' % (IPArray[0], IPArray[1], IPArray[2]), '.iprangecache']
-			elif Depth==2:
-				Command = ['grep', '[^0-9]%s\.%s\.[0-9]*\.[0-9]*' % (IPArray[0], IPArray[1]), '.iprangecache']
-			elif Depth==3:
-				Command = ['grep', '[^0-9]%s\.[0-9]*\.[0-9]*\.[0-9]*' % (IPArray[0]), '.iprangecache']
-			else:
-				Command = ['grep', '[^0-9][0-9]*\.[0-9]*\.[0-9]*\.[0-9]*', '.iprangecache']
-		else:
-			if Depth==1:
-				Command = ['grep', '[^0-9]%s\.%s\.%s\.[0-9]*' % (IPArray[0], IPArray[1], IPArray[2]), IPTablePath]
-			elif Depth==2:
-				Command = ['grep', '[^0-9]%s\.%s\.[0-9]*\.[0-9]*' % (IPArray[0], IPArray[1]), IPTablePath]
-				#print Command
-			elif Depth==3:
-				Command = ['grep', '[^0-9]%s\.[0-9]*\.[0-9]*\.[0-9]*' % (IPArray[0]), IPTablePath]
-			else:
-				Command = ['grep', '[^0-9][0-9]*\.[0-9]*\.[0-9]*\.[0-9]*', IPTablePath]
-		
+		cprint('[EdX Log] [StudentIP Data] Building binary IP database: %s' % BinaryPath, 'green')
 		
-		pipe = subprocess.Popen(Command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-		stdout, stderr = pipe.communicate()
+		Starts, Ends, Columns = ReadIPTableCSV()
 		
-		if len(stdout)>1:
-			
-			Output = stdout.splitlines()
-			
-			IPRangeListForCache = []
-			
-			for Match in Output:
-				
-				LocationItem_Match = re.findall(r'([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)\,([^\,]*)', Match)
-				
-				if len(LocationItem_Match)>0:
-					LocationItem = LocationItem_Match[0]
-				else:
-					cprint('[EdX Log] [StudentIP Data] [Error] IPLookup() - Format error on IP database: %s' % Match, 'red')
-					exit()
-					
-				if not FromCache:
-					IPRangeListForCache.append(Match)
-					
-				if IPv4Address(unicode(IP)) >= IPv4Address(unicode(LocationItem[0])) and IPv4Address(unicode(IP)) <= IPv4Address(unicode(LocationItem[1])):
-					LocationJSON = {
-						'LocalIPRange' : {
-							'Start' : LocationItem[0],
-							'End'	: LocationItem[1]
-						},
-						'Country' : {
-							'Code' : LocationItem[2],
-							'Name' : GetCountryName(LocationItem[2])
-						},
-						'District' : LocationItem[3],
-						'City' : LocationItem[4],
-						'Coordinates' : {
-							'Latitude' : LocationItem[5],
-							'Longitude' : LocationItem[6]
-						},
-						'TimeZone' : {
-							'Offset' : LocationItem[7],
-							'Name' : LocationItem[8].replace('\n','')
-						}
-					}
-
-					f = open('.ipcache', 'a')
-					Line = IP+' : '+','.join(LocationItem)
-					f.write(Line+'\n')
-					f.close()
-					
-					#print Match
-					f = open('.iprangecache', 'a')
-					f.write(Match+'\n')
-					f.close()
-					
-					return LocationJSON
-			
-			#f = open('.iprangecache', 'a')
-			#for IPRangeItem in IPRangeListForCache:
-			#	f.write(IPRangeItem+'\n')
-			#f.close()
-					
-		else:
+		# Build into temporary directory first, so that other processes never see a partial copy
+		TempPath = '%s.%s.tmp' % (BinaryPath, os.getpid())
+		os.makedirs(TempPath)
+		numpy.save(os.path.join(TempPath, 'Starts.npy'), numpy.array(Starts, dtype='uint32'))
+		numpy.save(os.path.join(TempPath, 'Ends.npy'), numpy.array(Ends, dtype='uint32'))
+		for Column, (Codes, Values) in zip(IPTableColumns, Columns):
+			numpy.save(os.path.join(TempPath, Column+'.npy'), numpy.array(Codes, dtype='uint32'))
+			WriteTextFile(os.path.join(TempPath, Column+'.txt'), '\n'.join(Values))
+		WriteTextFile(os.path.join(TempPath, 'Version.txt'), GetIPTableVersion())
 		
-			return None
-			
-	return None
+		# Replace outdated copy (processes that have it memory-mapped keep reading the old files)
+		if os.path.isdir(BinaryPath):
+			OldPath = '%s.%s.old' % (BinaryPath, os.getpid())
+			os.rename(BinaryPath, OldPath)
+			shutil.rmtree(OldPath)
+		os.rename(TempPath, BinaryPath)
+	finally:
+		fcntl.flock(LockFile, fcntl.LOCK_UN)
+		LockFile.close()
+
+# END DEF BuildIPTableFile ----------
+
+# Check if binary copy of IP database exists and is up to date (it can also be used without IP database file)
+def IsIPTableFileCurrent(BinaryPath):
+	if not os.path.isdir(BinaryPath):
+		return False
+	IPTableVersion = GetIPTableVersion()
+	return not IPTableVersion or ReadTextFile(os.path.join(BinaryPath, 'Version.txt'))==IPTableVersion
+
+# Memory-map .npy file read-only (as plain array, which is faster to index than numpy.memmap)
+def LoadMappedArray(FilePath):
+	return numpy.load(FilePath, mmap_mode='r').view(numpy.ndarray)
+
+# Get version of IP database file (size and modification time), to detect changes
+def GetIPTableVersion():
+	if not os.path.isfile(IPTablePath):
+		return None
+	return '%s,%s' % (os.path.getsize(IPTablePath), int(os.path.getmtime(IPTablePath)))
+
+# Read whole text file. Return None if file doesn't exist
+def ReadTextFile(FilePath):
+	try:
+		f = open(FilePath, 'r')
+	except IOError:
+		return None
+	Text = f.read()
+	f.close()
+	return Text
+
+# Write whole text file
+def WriteTextFile(FilePath, Text):
+	f = open(FilePath, 'w')
+	f.write(Text)
+	f.close()
+
+# Convert integer to IPv4 address string
+def IntToIP(IPInt):
+	return socket.inet_ntoa(PackIPv4(IPInt))
+
+# Convert IPv4 address string to integer. Return None if not a valid IPv4 address
+# (octets with leading zeros are rejected, since inet_aton() would read them as octal)
+IPv4Pattern = re.compile(r'^(?:(?:0|[1-9][0-9]{0,2})\.){3}(?:0|[1-9][0-9]{0,2})\Z')
+UnpackIPv4 = struct.Struct('!I').unpack
+PackIPv4 = struct.Struct('!I').pack
+def IPToInt(IP):
+	if not IPv4Pattern.match(IP):
+		return None
+	try:
+		return UnpackIPv4(socket.inet_aton(IP))[0]
+	except socket.error:
+		return None
+
+# Build location JSON out of IP range and location fields (country code, district, city, latitude, longitude, time zone offset, time zone name)
+def BuildLocationJSON(StartIP, EndIP, Location):
+	LocationJSON = {
+		'LocalIPRange' : {
+			'Start' : StartIP,
+			'End'	: EndIP
+		},
+		'Country' : {
+			'Code' : Location[0],
+			'Name' : GetCountryName(Location[0])
+		},
+		'District' : Location[1],
+		'City' : Location[2],
+		'Coordinates' : {
+			'Latitude' : Location[3],
+			'Longitude' : Location[4]
+		},
+		'TimeZone' : {
+			'Offset' : Location[5],
+			'Name' : Location[6]
+		}
+	}
+	return LocationJSON
+
+# IP Lookup
+# IPs are now located with the in-memory IP database and the persistent IP cache (see LocateIP), so depth and cache file don't matter
+def IPLookup(IP, Depth, FromCache):
+	return LocateIP(IP)
 	
 	
-# Get country name from country code
+# Get country name from country code (names are looked up once per country code)
+CountryNames = {}
 def GetCountryName(CountryCode):
+	if CountryCode in CountryNames:
+		return CountryNames[CountryCode]
 	if CountryCode=='YU':
-		return 'Yugoslavia'
+		CountryName = 'Yugoslavia'
 	elif CountryCode=='CS':
-		return 'Serbia and Montenegro'
+		CountryName = 'Serbia and Montenegro'
 	else:
 		CountryName = pycountry.countries.get(alpha2=str(CountryCode)).name
-		return unicodedata.normalize('NFKD', CountryName).encode('ascii','ignore')
+		CountryName = unicodedata.normalize('NFKD', CountryName).encode('ascii','ignore')
+	CountryNames[CountryCode] = CountryName
+	return CountryName
 	
 
 #=========================================================
@@ -1295,10 +2769,7 @@ def ParseVideoFile(FilePath, KeepAlive=False):
 	
 	# Get video ID
 	try:
-		Match = re.findall(r'(\d{4}\-\d{2}\-\d{2})[^/]*/([^/]*)/video/([a-zA-Z0-9]*).xml$', FilePath)[0]
-		LastLoggedDate = Match[0]
-		CourseID = Match[1]
-		VideoID = Match[2]
+		LastLoggedDate, CourseID, VideoID = ReadXMLPathFields(FilePath, 'Video')
 	except:
 		cprint('[EdX Log] [Video Data] [Error] ParseVideoFile() - Could not parse Video ID from file path.\nIn order to parse, the file path must contain the following pattern: *YYYY-MM-DD*/COURSEID/video/VIDEOID.xml, where YYYY-MM-DD is the EdX log date, COURSEID is a string not containing a forward slash, and VIDEOID is an alphanumeric string of length 32.', 'red')
 		exit()
@@ -1313,6 +2784,11 @@ def ParseVideoFile(FilePath, KeepAlive=False):
 	return VideoMetadataList
 	
 	
+# Read (EdX log date, course ID, video/problem ID) out of path of .xml file (*YYYY-MM-DD*/COURSEID/video/VIDEOID.xml). Return None if not found
+def ReadXMLPathFields(FilePath, ItemClass):
+	Match = re.findall(r'(\d{4}\-\d{2}\-\d{2})[^/]*/([^/]*)/%s/([a-zA-Z0-9]*).xml$' % ItemClass.lower(), FilePath)
+	return Match[0] if Match else None
+
 # Parse LIST with video metadata
 def ParseVideoList(XMLObjList, CourseID, VideoID, LastLoggedDate, KeepAlive=False):
 	
@@ -1438,10 +2914,7 @@ def ParseProblemFile(FilePath):
 	
 	# Get Problem ID
 	try:
-		Match = re.findall(r'(\d{4}\-\d{2}\-\d{2})[^/]*/([^/]*)/problem/([a-zA-Z0-9]*).xml$', FilePath)[0]
-		LastLoggedDate = Match[0]
-		CourseID = Match[1]
-		ProblemID = Match[2]
+		LastLoggedDate, CourseID, ProblemID = ReadXMLPathFields(FilePath, 'Problem')
 	except:
 		cprint('[EdX Log] [Problem Data] [Error] ParseProblemFile() - Could not parse Problem ID from file path.\nIn order to parse, the file path must contain the following pattern: *YYYY-MM-DD*/COURSEID/problem/PROBLEMID.xml, where YYYY-MM-DD is the EdX log date, COURSEID is a string not containing a forward slash, and PROBLEMID is an alphanumeric string of length 32.', 'red')
 		exit()
@@ -1523,30 +2996,258 @@ def ParseProblemItem(XMLProblemRoot, ProblemID):
 
 # END DEF ParseProblemItem ----------
 
+#=========================================================
+# BATCH PARSING FUNCTIONS
+#=========================================================
+
+# Find EdX data files in directory tree, and return list of parsing tasks (one per file and item class)
+# Dates (YYYY-MM-DD) are read from the file path. Files are selected if StartDate <= date <= EndDate
+# StudentIP items are only parsed if explicitly requested in ItemClasses, since they come from the same .log files as Click events
+def FindEdxFiles(RootPath, OutputPath, StartDate=None, EndDate=None, ItemClasses=['Click', 'Forum', 'SignUp', 'Video', 'Problem']):
+
+	TaskList = []
+	for DirPath, DirNames, FileNames in os.walk(RootPath):
+		DirNames.sort()
+		for FileName in sorted(FileNames):
+		
+			LOGFilePath = os.path.join(DirPath, FileName)
+			RelativePath = os.path.relpath(LOGFilePath, RootPath)
+			
+			# Get item classes of file. Skip if unknown file type
+			FileItemClasses = [ItemClass for ItemClass in GetFileItemClasses(RelativePath) if ItemClass in ItemClasses]
+			if len(FileItemClasses)==0:
+				continue
+			
+			# Get date of file. Skip if outside date range
+			FileDate = GetFileDate(RelativePath)
+			if StartDate or EndDate:
+				if not FileDate:
+					continue
+				if StartDate and FileDate<StartDate:
+					continue
+				if EndDate and FileDate>EndDate:
+					continue
+			
+			# Build output path: same relative path as input, with .ItemClass.json.gz extension (or extension of OutputCodec)
+			BaseName = re.sub(r'(\.log\.gz|\.log|\.mongo|\.sql|\.csv|\.xml)$', '', RelativePath)
+			for ItemClass in FileItemClasses:
+				JSONFilePath = os.path.join(OutputPath, '%s.%s.json%s' % (BaseName, ItemClass, CodecExtensions[OutputCodec]))
+				TaskList.append({'LOGFilePath' : LOGFilePath, 'JSONFilePath' : JSONFilePath, 'ItemClass' : ItemClass, 'Date' : FileDate, 'Size' : os.path.getsize(LOGFilePath)})
+	
+	return TaskList
+
+# END DEF FindEdxFiles ----------
+
+# Get item classes that can be parsed out of an EdX data file
+def GetFileItemClasses(FilePath):
+	FileName = os.path.basename(FilePath)
+	if FileName.endswith('.log.gz') or FileName.endswith('.log'):
+		return ['Click', 'StudentIP']
+	elif FileName.endswith('.mongo'):
+		return ['Forum']
+	elif (FileName.endswith('.sql') or FileName.endswith('.csv')) and 'student_courseenrollment' in FileName:
+		return ['SignUp']
+	elif re.search(r'(^|/)video/[a-zA-Z0-9]*\.xml$', FilePath):
+		return ['Video']
+	elif re.search(r'(^|/)problem/[a-zA-Z0-9]*\.xml$', FilePath):
+		return ['Problem']
+	else:
+		return []
+
+# Get date (YYYY-MM-DD) of an EdX data file out of its path. Return None if not found
+def GetFileDate(FilePath):
+	Match = re.search(r'(\d{4})-(\d{2})-(\d{2})', FilePath)
+	if not Match:
+		Match = re.search(r'(?<!\d)(20\d{2})(\d{2})(\d{2})(?!\d)', FilePath)
+	if Match:
+		return '%s-%s-%s' % Match.groups()
+	else:
+		return None
+
+# Parse all EdX data files in directory tree and save into CEDE .json files, using a pool of Workers processes
+# Existing .json files are skipped (as in ParseAndSave). A run manifest with per-file event counts and timings is saved to ManifestPath
+def ParseAndSaveTree(RootPath, OutputPath, StartDate=None, EndDate=None, ItemClasses=['Click', 'Forum', 'SignUp', 'Video', 'Problem'], Workers=1, Locate=False, KeepAlive=False, ManifestPath=None):
+	
+	# Get list of files to parse (biggest files first, so that the pool is not left waiting on a big file at the end)
+	TaskList = FindEdxFiles(RootPath, OutputPath, StartDate, EndDate, ItemClasses)
+	TaskList.sort(key=lambda Task: Task['Size'], reverse=True)
+	for Task in TaskList:
+		Task.update({'Locate' : Locate, 'KeepAlive' : KeepAlive})
+	
+	# Initialize run manifest
+	if not ManifestPath:
+		ManifestPath = os.path.join(OutputPath, 'manifest-%s.json' % datetime.utcnow().strftime('%Y%m%dT%H%M%S'))
+	Manifest = {'RootPath' : RootPath, 'OutputPath' : OutputPath, 'StartDate' : StartDate, 'EndDate' : EndDate, 'ItemClasses' : ItemClasses, 'Workers' : Workers, 'StartedAt' : ISO8601_utcnow(), 'FinishedAt' : None, 'Files' : []}
+	
+	if not os.path.isdir(OutputPath):
+		os.makedirs(OutputPath)
+	
+	cprint('[EdX Log] [Batch] [Parsing...] %s file(s) found in: %s' % (len(TaskList), RootPath), 'green', 'on_blue')
+	StartTime = time.time()
+	
+	# Parse files in a pool of processes, or in this process if Workers=1
+	if Workers>1:
+		Pool = multiprocessing.Pool(Workers)
+		ResultIter = Pool.imap_unordered(ParseAndSaveTask, TaskList)
+	else:
+		Pool = None
+		ResultIter = (ParseAndSaveTask(Task) for Task in TaskList)
+	
+	try:
+		for Result in ResultIter:
+			
+			# Add result to manifest. Manifest is saved after each file, so that it is up to date if the run is interrupted
+			Manifest['Files'].append(Result)
+			SaveManifest(Manifest, ManifestPath)
+			
+			# Print to shell: Result of parsed file
+			if Result['Status']=='Failed':
+				Color = 'red'
+			elif Result['Status']=='Skipped':
+				Color = 'yellow'
+			else:
+				Color = 'green'
+			cprint('[EdX Log] [Batch] [%s/%s] [%s] [%s Data] %s event(s), %s seconds: %s' % (len(Manifest['Files']), len(TaskList), Result['Status'], Result['ItemClass'], Result['EventCount'], int(round(Result['ElapsedTime'])), Result['LOGFilePath']), Color)
+		
+		if Pool:
+			Pool.close()
+			Pool.join()
+	finally:
+		if Pool:
+			Pool.terminate()
+	
+	# Save final manifest
+	Manifest['FinishedAt'] = ISO8601_utcnow()
+	SaveManifest(Manifest, ManifestPath)
+	
+	NumFailed = len([Result for Result in Manifest['Files'] if Result['Status']=='Failed'])
+	print('[EdX Log] [Batch] [Done parsing files] %s file(s) processed, %s failed. Elapsed time: %s seconds. Manifest: %s' % (len(Manifest['Files']), NumFailed, int(round(time.time() - StartTime)), ManifestPath))
+	
+	return Manifest
+
+# END DEF ParseAndSaveTree ----------
+
+# Parse single file of a batch run and return its manifest entry (runs in worker process)
+def ParseAndSaveTask(Task):
+	
+	StartTime = time.time()
+	Result = {'LOGFilePath' : Task['LOGFilePath'], 'JSONFilePath' : Task['JSONFilePath'], 'ItemClass' : Task['ItemClass'], 'Date' : Task['Date'], 'EventCount' : None, 'Error' : None}
+	
+	# Skip if .json file exists (with parse cache, .json files are only kept if they are up to date)
+	if os.path.isfile(Task['JSONFilePath']) and (not ParseCacheDir or IsParseKeyCurrent(Task['LOGFilePath'], Task['JSONFilePath'], Task['ItemClass'], Task['Locate'], Task['KeepAlive'])):
+		Result.update({'Status' : 'Skipped', 'ElapsedTime' : 0.0})
+		return Result
+	
+	# Parse and save. Errors (including exit() calls) are reported in the manifest, and do not stop the batch run
+	try:
+		OutputDir = os.path.dirname(Task['JSONFilePath'])
+		if OutputDir and not os.path.isdir(OutputDir):
+			try:
+				os.makedirs(OutputDir)
+			except OSError:
+				# Directory may have been created by another worker
+				if not os.path.isdir(OutputDir):
+					raise
+		CacheKey = None
+		RemoveParseKey(Task['JSONFilePath'])
+		if ParseCacheDir:
+			ContentHash = GetContentHash(Task['LOGFilePath'])
+			CacheKey = GetParseCacheKey(Task['LOGFilePath'], Task['ItemClass'], Task['Locate'], Task['KeepAlive'], ContentHash)
+			if LoadFromParseCache(Task['LOGFilePath'], Task['JSONFilePath'], Task['ItemClass'], CacheKey, ContentHash):
+				Result.update({'Status' : 'Cached', 'ElapsedTime' : time.time() - StartTime})
+				return Result
+		ItemList = ParseFile(Task['LOGFilePath'], Task['ItemClass'], Task['Locate'], Task['KeepAlive'], Encode=True)
+		Result.update({'Status' : 'Parsed', 'EventCount' : SaveIterToJSON(ItemList, Task['JSONFilePath'])})
+		if CacheKey:
+			SaveToParseCache(Task['LOGFilePath'], Task['JSONFilePath'], CacheKey, ContentHash)
+	except (Exception, SystemExit), e:
+		Result.update({'Status' : 'Failed', 'Error' : repr(e)})
+	
+	Result['ElapsedTime'] = time.time() - StartTime
+	return Result
+
+# Save batch run manifest as (pretty-printed) JSON file
+def SaveManifest(Manifest, ManifestPath):
+	TempFilePath = '%s.tmp' % ManifestPath
+	f = open(TempFilePath, 'w')
+	f.write(json.dumps(Manifest, sort_keys=True, indent=4, separators=(',', ': ')))
+	f.close()
+	os.rename(TempFilePath, ManifestPath)
+
 #=========================================================
 # MONGO-DB MANAGEMENT FUNCTIONS
 #=========================================================
 
-def MongoDB_writefilelist(Collection, JSONFileList, ItemClass):
+# Write list of JSON files into MongoDB collection. Return log lines (in the order of JSONFileList)
+# With Workers>1, files are taken from a shared queue by a pool of Workers processes, each with its own MongoClient
+# Workers connect to Host (MongoDB URI, with credentials and options) with client Options, or with the settings the client of Collection was opened with (see MongoDB_open)
+def MongoDB_writefilelist(Collection, JSONFileList, ItemClass, Workers=1, Host=None, **Options):
 	
 	LogLines = []
 	
-	for JSONFilePath in JSONFileList:
-		LogLines += MongoDB_writefile(Collection, JSONFilePath, ItemClass)
+	if Workers>1 and len(JSONFileList)>1:
+		if not Host:
+			if not id(Collection.database.client) in MongoDBClientSettings:
+				cprint('%s [MongoDB] [%s Data] [Error] MongoDB_writefilelist() - MongoDB URI (Host) is required with Workers>1, unless the collection was opened with MongoDB_open()' % (ISO8601_utcnow(), ItemClass), 'red')
+				exit()
+			Client, Host, Options = MongoDBClientSettings[id(Collection.database.client)]
+		
+		# Check connection settings before starting workers (otherwise every file would fail in the workers)
+		try:
+			Client = pymongo.MongoClient(Host, **Options)
+			try:
+				Client[Collection.database.name].command('ping')
+			finally:
+				Client.close()
+		except pymongo.errors.PyMongoError, e:
+			cprint('%s [MongoDB] [%s Data] [Error] MongoDB_writefilelist() - Workers cannot connect to MongoDB. Error message: %s' % (ISO8601_utcnow(), ItemClass, repr(e)), 'red')
+			exit()
+		
+		Pool = multiprocessing.Pool(Workers, MongoDB_initworker, (Host, Options, Collection.database.name, Collection.name))
+		try:
+			for FileLogLines in Pool.imap(MongoDB_writefiletask, [(JSONFilePath, ItemClass) for JSONFilePath in JSONFileList]):
+				LogLines += FileLogLines
+			Pool.close()
+			Pool.join()
+		finally:
+			Pool.terminate()
+		return LogLines
+	
+	for FileNumber, JSONFilePath in enumerate(JSONFileList):
+		NextFilePath = JSONFileList[FileNumber+1] if FileNumber+1<len(JSONFileList) else None
+		LogLines += MongoDB_writefile(Collection, JSONFilePath, ItemClass, NextFilePath)
 		
 	return LogLines
-	
 
-def MongoDB_writefile(Collection, JSONFilePath, ItemClass):
+# Collection of MongoDB worker process (see MongoDB_initworker)
+MongoDBWorkerCollection = None
 
-	JSONItemList = LoadEventFile(JSONFilePath)
+# Connect MongoDB worker process to collection (runs once in each worker process)
+def MongoDB_initworker(Host, Options, DatabaseName, CollectionName):
+	global MongoDBWorkerCollection
+	MongoDBWorkerCollection = pymongo.MongoClient(Host, **Options)[DatabaseName][CollectionName]
+
+# Write single JSON file of a parallel load and return its log lines (runs in worker process)
+# Errors (including exit() calls) are returned as log lines, and do not stop the other files
+def MongoDB_writefiletask(Task):
+	JSONFilePath, ItemClass = Task
+	try:
+		return MongoDB_writefile(MongoDBWorkerCollection, JSONFilePath, ItemClass)
+	except (Exception, SystemExit), e:
+		ShellMSG = '%s [MongoDB] [%s Data] [Error] MongoDB_writefile() - Unable to process JSON file: %s. Error message: %s' % (ISO8601_utcnow(), ItemClass, JSONFilePath, repr(e))
+		cprint(ShellMSG, 'red')
+		return [ShellMSG]
 	
+
+def MongoDB_writefile(Collection, JSONFilePath, ItemClass, NextFilePath=None):
+
 	LogLines = []
 	ShellMSG = '%s [MongoDB] [%s Data] Loaded JSON file: %s' % (ISO8601_utcnow(), ItemClass, JSONFilePath)
 	print ShellMSG
 	LogLines.append(ShellMSG)
-			
-	LogLines += MongoDB_writelist(Collection, JSONItemList, ItemClass)
+	
+	# JSON items are streamed from file into bulk writes (the next file is decompressed ahead meanwhile)
+	LogLines += MongoDB_writelist(Collection, IterEventFile(JSONFilePath, NextFilePath=NextFilePath), ItemClass)
 	
 	ShellMSG = '%s [MongoDB] [%s Data] [Success] Done processing JSON file: %s' % (ISO8601_utcnow(), ItemClass, JSONFilePath)
 	print ShellMSG
@@ -1554,28 +3255,129 @@ def MongoDB_writefile(Collection, JSONFilePath, ItemClass):
 	
 	return LogLines
 
+# Parse EdX file and write clean JSON items straight into MongoDB, without going through a .json file
+# Items are passed in batches through a bounded queue to a writer thread, so that parsing and writing overlap (the parser waits if the queue is full)
+# Items are also saved into a .json file if JSONFilePath is given. Return log lines
+def MongoDB_parseandwrite(Collection, LOGFilePath, ItemClass, JSONFilePath=None, Locate=False, KeepAlive=False, Workers=1, BatchSize=None, WriteConcern=None, PreviousItems=None):
+
+	BatchSize = BatchSize or MongoDBBatchSize
+	
+	# Start writer thread
+	ItemQueue = Queue.Queue(MongoDBQueueSize)
+	Writer = {'LogLines' : [], 'Error' : None, 'Done' : False}
+	WriterThread = threading.Thread(target=MongoDB_writequeue, args=(Collection, ItemQueue, ItemClass, BatchSize, WriteConcern, Writer))
+	WriterThread.daemon = True
+	WriterThread.start()
+	
+	# Parse file and feed queue. Items are only encoded as JSON strings if they are saved into .json file (the writer decodes them)
+	try:
+		ItemList = ParseFile(LOGFilePath, ItemClass, Locate, KeepAlive, Workers, Encode=JSONFilePath is not None, PreviousItems=PreviousItems)
+		JSONItemList = MongoDB_feedqueue(ItemList, ItemQueue, BatchSize)
+		if JSONFilePath:
+			SaveIterToJSON(JSONItemList, JSONFilePath)
+		else:
+			for JSONItem in JSONItemList:
+				pass
+	finally:
+		ItemQueue.put(None)
+		WriterThread.join()
+	
+	if Writer['Error']:
+		cprint('%s [MongoDB] [%s Data] [Error] MongoDB_parseandwrite() - Writer failed: %s' % (ISO8601_utcnow(), ItemClass, Writer['Error']), 'red')
+		exit()
+	
+	ShellMSG = '%s [MongoDB] [%s Data] [Success] Done processing file: %s' % (ISO8601_utcnow(), ItemClass, LOGFilePath)
+	print ShellMSG
+	Writer['LogLines'].append(ShellMSG)
+	
+	return Writer['LogLines']
 
-def MongoDB_writelist(Collection, JSONItemList, ItemClass):
+# Put items into queue in batches, and yield them
+def MongoDB_feedqueue(ItemList, ItemQueue, BatchSize):
+	for ItemBatch in ChunkIter(ItemList, BatchSize):
+		ItemQueue.put(ItemBatch)
+		for Item in ItemBatch:
+			yield Item
 
+# Write batches of items from queue into MongoDB, until None is received (runs in writer thread)
+# On errors, the queue is still emptied, so that the parser is never left waiting
+def MongoDB_writequeue(Collection, ItemQueue, ItemClass, BatchSize, WriteConcern, Writer):
+	
+	def IterQueue():
+		for ItemBatch in iter(ItemQueue.get, None):
+			for Item in ItemBatch:
+				yield Item
+		Writer['Done'] = True
+	
+	try:
+		Writer['LogLines'] = MongoDB_writelist(Collection, IterQueue(), ItemClass, BatchSize, WriteConcern)
+	except Exception, e:
+		Writer['Error'] = repr(e)
+		if not Writer['Done']:
+			for Item in IterQueue():
+				pass
+
+# Add or replace JSON items (strings or dicts) as Mongo documents, with unordered bulk writes of BatchSize documents
+# Errors are reported once per batch (the other documents of the batch are still written). Return log lines
+def MongoDB_writelist(Collection, JSONItemList, ItemClass, BatchSize=None, WriteConcern=None):
+
+	BatchSize = BatchSize or MongoDBBatchSize
+	WriteConcern = WriteConcern or MongoDBWriteConcern
+	if WriteConcern:
+		Collection = Collection.with_options(write_concern=pymongo.write_concern.WriteConcern(**WriteConcern))
+	
 	LogLines = []
-	for JSONItem in JSONItemList:	
-		ShellMSG = MongoDB_write(Collection, JSONItem, ItemClass)
-		if False:#ShellMSG[0]:
-			cprint(ShellMSG[0], ShellMSG[1])
-			if ShellMSG[1]=='red':
-				exit()
+	NumWritten = 0
+	NumErrors = 0
+	for BatchNumber, JSONItemBatch in enumerate(ChunkIter(JSONItemList, BatchSize)):
+		
+		# Build upserts (items without _id are reported as errors)
+		Requests = []
+		for JSONItem in JSONItemBatch:
+			Document = MongoDB_document(JSONItem, ItemClass)
+			if isinstance(Document, list):
+				cprint(Document[0], Document[1])
+				LogLines.append(Document[0])
+				NumErrors += 1
 			else:
-				LogLines.append(ShellMSG[0])
+				Requests.append(ReplaceOne({'_id' : Document['_id']}, Document, upsert=True))
+		if not Requests:
+			continue
 		
+		try:
+			Result = Collection.bulk_write(Requests, ordered=False)
+			NumWritten += Result.upserted_count + Result.matched_count
+		except pymongo.errors.BulkWriteError, e:
+			WriteErrors = e.details.get('writeErrors', [])
+			NumWritten += e.details.get('nUpserted', 0) + e.details.get('nMatched', 0)
+			NumErrors += len(WriteErrors)
+			ShellMSG = '%s [MongoDB] [%s Data] [Error] MongoDB_writelist() - Unable to add %s of %s item(s) of batch %s. First error message: %s' % (ISO8601_utcnow(), ItemClass, len(WriteErrors), len(Requests), BatchNumber, WriteErrors[0]['errmsg'] if WriteErrors else e)
+			cprint(ShellMSG, 'red')
+			LogLines.append(ShellMSG)
+		except pymongo.errors.PyMongoError, e:
+			NumErrors += len(Requests)
+			ShellMSG = '%s [MongoDB] [%s Data] [Error] MongoDB_writelist() - Unable to add %s item(s) of batch %s. Error message: %s' % (ISO8601_utcnow(), ItemClass, len(Requests), BatchNumber, e)
+			cprint(ShellMSG, 'red')
+			LogLines.append(ShellMSG)
+	
+	ShellMSG = '%s [MongoDB] [%s Data] %s item(s) added or replaced, %s error(s)' % (ISO8601_utcnow(), ItemClass, NumWritten, NumErrors)
+	print ShellMSG
+	LogLines.append(ShellMSG)
+	
 	return LogLines
 	
 	
 
-def MongoDB_open():
+# Connection settings of clients opened with MongoDB_open (id of client -> (client, host, options)), so that worker processes can open the same connection (see MongoDB_writefilelist)
+MongoDBClientSettings = {}
+
+# Connect to MongoDB (Host: MongoDB URI, default: local server), with client Options (e.g. replicaset, ssl)
+def MongoDB_open(Host=None, **Options):
 	
 	# Connection to Mongo DB
 	try:
-		MongoID = pymongo.MongoClient()
+		MongoID = pymongo.MongoClient(Host, **Options)
+		MongoDBClientSettings[id(MongoID)] = (MongoID, Host, Options)
 		print "Connected to MongoDB"
 	except pymongo.errors.ConnectionFailure, e:
 		print "Failed to connect: %s" % e 
@@ -1583,14 +3385,97 @@ def MongoDB_open():
 	# Get database pointer
 	return MongoID
 	
-def MongoDB_read():
-	return
+# Read documents of item class from MongoDB collection, and yield them one at a time from the cursor (no list is built)
+# Filters are optional: CourseID, StudentID, and EventType may be single values or lists, and StartTime (inclusive) and EndTime (exclusive) POSIX or ISO8601 times
+# Projection is passed to find() (e.g. ['Event.StudentID', 'Event.TimeStamp'])
+def MongoDB_read(Collection, ItemClass, CourseID=None, StudentID=None, EventType=None, StartTime=None, EndTime=None, Projection=None, BatchSize=None):
+	
+	Fields = MongoDBFields.get(ItemClass)
+	if Fields is None:
+		cprint('%s [MongoDB] [Error] MongoDB_read() - Unknown item class: %s' % (ISO8601_utcnow(), ItemClass), 'red')
+		exit()
+	
+	# Build query
+	Query = {}
+	for Name, Value in [('CourseID', CourseID), ('StudentID', StudentID), ('EventType', EventType)]:
+		if Value is None:
+			continue
+		if not Name in Fields:
+			cprint('%s [MongoDB] [%s Data] [Error] MongoDB_read() - %s filter not available' % (ISO8601_utcnow(), ItemClass, Name), 'red')
+			exit()
+		if isinstance(Value, (list, tuple, set)):
+			Query[Fields[Name]] = {'$in' : list(Value)}
+		else:
+			Query[Fields[Name]] = Value
+	if StartTime is not None or EndTime is not None:
+		if not 'Time' in Fields:
+			cprint('%s [MongoDB] [%s Data] [Error] MongoDB_read() - Time filter not available' % (ISO8601_utcnow(), ItemClass), 'red')
+			exit()
+		TimeRange = {}
+		if StartTime is not None:
+			TimeRange['$gte'] = ISO8601_to_POSIXtime(StartTime) if isinstance(StartTime, basestring) else StartTime
+		if EndTime is not None:
+			TimeRange['$lt'] = ISO8601_to_POSIXtime(EndTime) if isinstance(EndTime, basestring) else EndTime
+		Query[Fields['Time']] = TimeRange
+	
+	Cursor = Collection.find(Query, Projection).batch_size(BatchSize or MongoDBReadBatchSize)
+	try:
+		for Document in Cursor:
+			yield Document
+	finally:
+		Cursor.close()
+
+# Get change keys of forum items in MongoDB collection, to skip unchanged items of the next snapshot (see GetForumChangeKeys)
+# Items are keyed on their "updated_at" field, since their content hash is not stored
+def MongoDB_getforumchangekeys(Collection, CourseID=None):
+	
+	Items = {}
+	Projection = ['Event.EventMetadata.%s.UpdatedAt.POSIX' % Metadata for Metadata in ['ThreadMetadata', 'PostMetadata', 'CommentMetadata']]
+	for Document in MongoDB_read(Collection, 'Forum', CourseID=CourseID, Projection=Projection):
+		EventMetadata = Document.get('Event', {}).get('EventMetadata', {})
+		for Metadata in ['CommentMetadata', 'PostMetadata', 'ThreadMetadata']:
+			if Metadata in EventMetadata:
+				Items[Document['_id']] = int(round(EventMetadata[Metadata]['UpdatedAt']['POSIX']*1000))
+				break
+	
+	return {'ChangeKey' : 'UpdatedAt', 'Items' : Items}
+
+# Create indexes of item class in MongoDB collection, unless they exist already. Return log lines
+def MongoDB_createindexes(Collection, ItemClass):
+	
+	LogLines = []
+	for Index in MongoDBIndexes.get(ItemClass, []):
+		IndexName = Collection.create_index(Index, background=True)
+		ShellMSG = '%s [MongoDB] [%s Data] Index ready: %s' % (ISO8601_utcnow(), ItemClass, IndexName)
+		print ShellMSG
+		LogLines.append(ShellMSG)
+	
+	return LogLines
 	
 def MongoDB_write(Collection, JSONItem, ItemClass):
 	
 	# Create document from JSON Item
-	Document = json.loads(JSONItem)
+	Document = MongoDB_document(JSONItem, ItemClass)
+	if isinstance(Document, list):
+		return Document
+	
+	#------------------------------------------------
+	# Add or Replace JSON Item as New Mongo Document
+	#------------------------------------------------
+	try:
+		Collection.save(Document) # save = replace
+		return True
+	except pymongo.errors.DuplicateKeyError, e:
+	
+		ShellMSG = '%s [MongoDB] [%s Data] [Error] MongoDB_write() - Unable to add item: {\'_id\' : \'%s\'}. Error message: %s' % (ISO8601_utcnow(), ItemClass, Document['_id'], e)
+		cprint(ShellMSG, 'red')
+		return False#[ShellMSG, 'red']
+
+# Create Mongo document from JSON item (string or dict), with _id field of its item class
+# Return [error message, color] if item has no _id
+def MongoDB_document(JSONItem, ItemClass):
 	
+	Document = DecodeEvent(JSONItem)
 
 	#----------------------------
 	# Click or SignUp Event Item
@@ -1612,7 +3497,7 @@ def MongoDB_write(Collection, JSONItem, ItemClass):
 			Document.update({'_id' : Document['Event']['EventMetadata']['CommentMetadata']['CommentID']})
 		else:
 			e = 'Unknown forum event type.'
-			ShellMSG = '%s [MongoDB] [%s Data] [Error] MongoDB_write() - Unable to add item: {\'_id\' : \'%s\'}. Error message: %s' % (ISO8601_utcnow(), ItemClass, Document['_id'], e)
+			ShellMSG = '%s [MongoDB] [%s Data] [Error] MongoDB_document() - Unable to add item: {\'EventID\' : \'%s\'}. Error message: %s' % (ISO8601_utcnow(), ItemClass, Document['Event'].get('EventID'), e)
 			return [ShellMSG, 'red']
 	
 	
@@ -1628,26 +3513,4 @@ def MongoDB_write(Collection, JSONItem, ItemClass):
 	
 		Document.update({'_id' : Document['ProblemID']})
 	
-	#------------------------------------------------
-	# Add or Replace JSON Item as New Mongo Document
-	#------------------------------------------------
-	try:
-		Collection.save(Document) # save = replace
-#		if Collection.find_one({'_id' : Document['_id']}):
-			#Collection.save(Document)
-		#ShellMSG = '%s [MongoDB] [%s Data] [Item added] {\'_id\' : \'%s\'}' % (ISO8601_utcnow(), ItemClass, Document['_id'])
-		#cprint(ShellMSG, 'green')
-		#return [ShellMSG, 'cyan']
-#			ShellMSG = '%s [MongoDB] [%s Data] [Warning] Item already exists: {\'_id\' : \'%s\'}' % (ISO8601_utcnow(), ItemClass, Document['_id'])
-#			return [ShellMSG, 'magenta']
-#		else:
-#			Collection.insert(Document)
-#			ShellMSG = '%s [MongoDB] [%s Data] [Success] Item added: {\'_id\' : \'%s\'}' % (ISO8601_utcnow(), ItemClass, Document['_id'])
-#			return [ShellMSG, 'green']
-		return True
-	except pymongo.errors.DuplicateKeyError, e:
-	
-		ShellMSG = '%s [MongoDB] [%s Data] [Error] MongoDB_write() - Unable to add item: {\'_id\' : \'%s\'}. Error message: %s' % (ISO8601_utcnow(), ItemClass, Document['_id'], e)
-		cprint(ShellMSG, 'red')
-		return False#[ShellMSG, 'red']
-
+	return Document